@@ -36,7 +36,7 @@ export default function MLDashboard() {
   const checkMlService = async () => {
     setMlServiceStatus('checking');
     try {
-      const response = await fetch('http://localhost:5001/health');
+      const response = await fetch('/api/ml/health');
       if (response.ok) {
         setMlServiceStatus('online');
       } else {
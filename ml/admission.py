@@ -0,0 +1,229 @@
+"""
+Controllo di ammissione per l'API ML
+Tutte le route di inferenza condividono un unico pool di slot di esecuzione,
+così le richieste interattive hanno la precedenza sullo scoring massivo di
+qualsiasi route; ogni route mantiene la propria coda limitata. Gestisce le
+scadenze indicate dal client e rifiuta rapidamente le richieste quando il
+servizio è saturo
+"""
+
+import os
+import time
+import threading
+import functools
+from flask import request, jsonify
+
+# Header con la scadenza della richiesta (epoch in millisecondi)
+DEADLINE_HEADER = 'X-Request-Deadline'
+
+# Header con la classe di priorità della richiesta
+PRIORITY_HEADER = 'X-Request-Priority'
+
+# Classi di priorità: le chiamate interattive dei widget precedono lo scoring massivo
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+
+# Richieste in esecuzione contemporanea nel processo (condivise tra tutte le route)
+MAX_IN_FLIGHT = int(os.environ.get('ML_MAX_IN_FLIGHT', 4))
+
+# Richieste in attesa per route (le richieste bulk possono occupare solo metà coda)
+MAX_QUEUE = int(os.environ.get('ML_MAX_QUEUE', 16))
+
+# Attesa massima in coda prima di rispondere 503
+MAX_QUEUE_WAIT_MS = int(os.environ.get('ML_MAX_QUEUE_WAIT_MS', 2000))
+
+# Secondi suggeriti al client nell'header Retry-After
+RETRY_AFTER_SECONDS = 1
+
+class Saturated(Exception):
+    """
+    La coda della route è piena
+    """
+
+class QueueTimeout(Exception):
+    """
+    L'attesa in coda ha superato il tempo disponibile
+    """
+
+class CapacityPool:
+    """
+    Slot di esecuzione condivisi tra le route, con precedenza alle richieste interattive
+    """
+
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT):
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.waiting = {INTERACTIVE: 0, BULK: 0}
+        self._cond = threading.Condition()
+
+    def _can_run(self, priority):
+        if self.in_flight >= self.max_in_flight:
+            return False
+        # Le richieste bulk partono solo se nessuna richiesta interattiva (di qualsiasi route) è in attesa
+        return priority == INTERACTIVE or self.waiting[INTERACTIVE] == 0
+
+    def stats(self):
+        with self._cond:
+            return {
+                'max_in_flight': self.max_in_flight,
+                'in_flight': self.in_flight,
+                'waiting': dict(self.waiting)
+            }
+
+class RouteLimiter:
+    """
+    Coda limitata di una singola route sul pool condiviso
+    """
+
+    def __init__(self, name, pool, max_queue=MAX_QUEUE):
+        self.name = name
+        self.pool = pool
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.waiting = {INTERACTIVE: 0, BULK: 0}
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def acquire(self, priority, timeout):
+        """
+        Attende uno slot libero del pool per al massimo timeout secondi
+
+        Raises:
+            Saturated: se la coda della route è piena
+            QueueTimeout: se lo slot non si libera in tempo
+        """
+        pool = self.pool
+        with pool._cond:
+            if pool._can_run(priority) and pool.waiting[priority] == 0:
+                pool.in_flight += 1
+                self.in_flight += 1
+                self.admitted += 1
+                return
+
+            queued = self.waiting[INTERACTIVE] + self.waiting[BULK]
+            limit = self.max_queue if priority == INTERACTIVE else self.max_queue // 2
+            if queued >= limit or timeout <= 0:
+                self.rejected += 1
+                raise Saturated()
+
+            self.waiting[priority] += 1
+            pool.waiting[priority] += 1
+            end = time.monotonic() + timeout
+            try:
+                while not pool._can_run(priority):
+                    remaining = end - time.monotonic()
+                    if remaining <= 0:
+                        self.timed_out += 1
+                        raise QueueTimeout()
+                    pool._cond.wait(remaining)
+            finally:
+                self.waiting[priority] -= 1
+                pool.waiting[priority] -= 1
+                # Una richiesta interattiva che rinuncia può sbloccare le bulk in attesa
+                pool._cond.notify_all()
+
+            pool.in_flight += 1
+            self.in_flight += 1
+            self.admitted += 1
+
+    def release(self):
+        """
+        Libera lo slot e risveglia le richieste in attesa
+        """
+        with self.pool._cond:
+            self.pool.in_flight -= 1
+            self.in_flight -= 1
+            self.pool._cond.notify_all()
+
+    def stats(self):
+        with self.pool._cond:
+            return {
+                'in_flight': self.in_flight,
+                'waiting': dict(self.waiting),
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out
+            }
+
+_pool = CapacityPool()
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def _get_limiter(route):
+    with _limiters_lock:
+        if route not in _limiters:
+            _limiters[route] = RouteLimiter(route, _pool)
+        return _limiters[route]
+
+def _parse_deadline(value):
+    """
+    Converte l'header di scadenza (epoch ms) in secondi, None se assente o non valido
+    """
+    if not value:
+        return None
+    try:
+        return float(value) / 1000.0
+    except ValueError:
+        return None
+
+def _reject(status, message):
+    response = jsonify({'error': message})
+    response.status_code = status
+    if status in (429, 503):
+        response.headers['Retry-After'] = str(RETRY_AFTER_SECONDS)
+    return response
+
+def admit(route, default_priority=INTERACTIVE):
+    """
+    Decoratore che applica il controllo di ammissione a una route Flask
+
+    Args:
+        route: Nome della coda (una per endpoint, gli slot sono condivisi)
+        default_priority: Priorità usata se il client non invia PRIORITY_HEADER
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            deadline = _parse_deadline(request.headers.get(DEADLINE_HEADER))
+            priority = request.headers.get(PRIORITY_HEADER, default_priority)
+            if priority not in (INTERACTIVE, BULK):
+                priority = default_priority
+
+            timeout = MAX_QUEUE_WAIT_MS / 1000.0
+            if deadline is not None:
+                timeout = min(timeout, deadline - time.time())
+                if timeout <= 0:
+                    return _reject(504, 'Deadline exceeded')
+
+            limiter = _get_limiter(route)
+            try:
+                limiter.acquire(priority, timeout)
+            except Saturated:
+                return _reject(429, 'Service saturated')
+            except QueueTimeout:
+                if deadline is not None and time.time() >= deadline:
+                    return _reject(504, 'Deadline exceeded')
+                return _reject(503, 'Service overloaded')
+
+            try:
+                # Salta l'inferenza se la scadenza è passata durante l'attesa
+                if deadline is not None and time.time() >= deadline:
+                    return _reject(504, 'Deadline exceeded')
+                return view(*args, **kwargs)
+            finally:
+                limiter.release()
+
+        return wrapper
+    return decorator
+
+def stats():
+    """
+    Statistiche di ammissione del pool condiviso e di ogni route
+    """
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {
+        'pool': _pool.stats(),
+        'routes': {limiter.name: limiter.stats() for limiter in limiters}
+    }
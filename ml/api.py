@@ -11,13 +11,23 @@ from flask_cors import CORS
 import traceback
 import json
 
+# La politica di threading va applicata prima di caricare numpy/sklearn/xgboost
+import thread_policy
+thread_policy.configure()
+
 # Import dei moduli ML
 import dynamic_pricing
 import predictive_churn
 import user_clustering
+import similar_users
+import cluster_analytics
+import admission
+import drift
+import profiling
 
 app = Flask(__name__)
 CORS(app)  # Abilita CORS per consentire richieste dal frontend
+profiling.init_app(app)  # Hook del profiler (inattivi finché non si avvia una sessione)
 
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -30,10 +40,13 @@ def health_check():
             'dynamic_pricing': True,
             'predictive_churn': True,
             'user_clustering': True
-        }
+        },
+        'admission': admission.stats(),
+        'threading': thread_policy.report()
     })
 
 @app.route('/dynamic-pricing', methods=['POST'])
+@admission.admit('dynamic-pricing')
 def price_suggestion():
     """
     Endpoint per il dynamic pricing
@@ -54,7 +67,36 @@ def price_suggestion():
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+@app.route('/dynamic-pricing/sweep', methods=['POST'])
+@admission.admit('dynamic-pricing-sweep', default_priority=admission.BULK)
+def price_sweep():
+    """
+    Endpoint per lo sweep what-if del dynamic pricing
+    Richiede un JSON con 'property' (dati base) e 'grid' (valori per feature)
+    """
+    try:
+        data = request.json
+        
+        if not data:
+            return jsonify({'error': 'No data provided'}), 400
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Request body must be a JSON object'}), 400
+        
+        # Valuta l'intera griglia con una sola predizione (i tipi vengono validati dal modello)
+        property_data = data.get('property')
+        result = dynamic_pricing.predict_price_sweep({} if property_data is None else property_data, data.get('grid'))
+        
+        return jsonify(result)
+    
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/churn', methods=['POST'])
+@admission.admit('churn')
 def churn_prediction():
     """
     Endpoint per la previsione di churn
@@ -76,6 +118,7 @@ def churn_prediction():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/cluster', methods=['POST'])
+@admission.admit('cluster')
 def user_segment():
     """
     Endpoint per il clustering degli utenti
@@ -90,12 +133,218 @@ def user_segment():
         # Chiama il modello di clustering
         result = user_clustering.predict_user_cluster(data)
         
+        # Aggiorna le statistiche dei segmenti (solo utenti identificati)
+        cluster_analytics.record_assignments([data], [result['cluster_id']])
+        
+        return jsonify(result)
+    
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+# Numero massimo di elementi per richiesta batch
+MAX_BATCH_ITEMS = 256
+
+def _batch_items():
+    """
+    Estrae e valida la lista 'items' di una richiesta batch
+    """
+    data = request.json or {}
+    items = data.get('items')
+    if not isinstance(items, list) or not items:
+        raise ValueError('No items provided')
+    if len(items) > MAX_BATCH_ITEMS:
+        raise ValueError(f'Too many items (max {MAX_BATCH_ITEMS})')
+    return items
+
+@app.route('/dynamic-pricing/batch', methods=['POST'])
+@admission.admit('dynamic-pricing-batch')
+def price_suggestion_batch():
+    """
+    Endpoint batch per il dynamic pricing
+    Richiede un JSON con 'items': lista di proprietà; risultati nello stesso ordine
+    """
+    try:
+        return jsonify({'results': dynamic_pricing.predict_price_change_batch(_batch_items())})
+    
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/churn/batch', methods=['POST'])
+@admission.admit('churn-batch')
+def churn_prediction_batch():
+    """
+    Endpoint batch per la previsione di churn
+    Richiede un JSON con 'items': lista di utenti; risultati nello stesso ordine
+    """
+    try:
+        return jsonify({'results': predictive_churn.predict_churn_risk_batch(_batch_items())})
+    
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/cluster/batch', methods=['POST'])
+@admission.admit('cluster-batch')
+def user_segment_batch():
+    """
+    Endpoint batch per il clustering degli utenti
+    Richiede un JSON con 'items': lista di utenti; risultati nello stesso ordine
+    """
+    try:
+        items = _batch_items()
+        results = user_clustering.predict_user_cluster_batch(items)
+        cluster_analytics.record_assignments(items, [result['cluster_id'] for result in results])
+        return jsonify({'results': results})
+    
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/clusters/summary', methods=['GET'])
+def clusters_summary():
+    """
+    Endpoint per il riepilogo dei segmenti utente
+    Dimensioni, medie e deviazioni standard delle feature per cluster e transizioni tra cluster
+    """
+    try:
+        return jsonify(cluster_analytics.cluster_summary())
+    
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/similar-users', methods=['POST'])
+@admission.admit('similar-users')
+def similar_users_lookup():
+    """
+    Endpoint per la ricerca degli utenti simili
+    Richiede un JSON con 'user_id' e opzionalmente 'k'
+    """
+    try:
+        data = request.json
+        
+        if not data or data.get('user_id') is None:
+            return jsonify({'error': 'No user_id provided'}), 400
+        
+        # Cerca i vicini nello spazio PCA del clustering
+        result = similar_users.find_similar_users(data['user_id'], data.get('k', similar_users.DEFAULT_K))
+        
         return jsonify(result)
     
+    except KeyError:
+        return jsonify({'error': 'User not indexed'}), 404
+    
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/similar-users/index', methods=['POST'])
+@admission.admit('similar-users-index', default_priority=admission.BULK)
+def similar_users_insert():
+    """
+    Endpoint per inserire o aggiornare utenti nell'indice di similarità
+    Richiede un JSON con 'users': lista di utenti con 'user_id' e feature del clustering
+    """
+    try:
+        data = request.json
+        
+        if not data or not data.get('users'):
+            return jsonify({'error': 'No users provided'}), 400
+        
+        result = similar_users.add_users(data['users'])
+        
+        return jsonify(result)
+    
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/drift', methods=['GET'])
+def input_drift():
+    """
+    Endpoint per il report di deriva degli input
+    Confronta gli input serviti da tutti i worker con il profilo di addestramento
+    """
+    try:
+        return jsonify({
+            'dynamic_pricing': drift.drift_report('dynamic_pricing', dynamic_pricing.load_model()),
+            'predictive_churn': drift.drift_report('predictive_churn', predictive_churn.load_model()),
+            'user_clustering': drift.drift_report('user_clustering', user_clustering.load_model())
+        })
+    
     except Exception as e:
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+@app.route('/profiling/start', methods=['POST'])
+def profiling_start():
+    """
+    Avvia una sessione di profiling a campionamento
+    Richiede l'header X-Admin-Token e un JSON opzionale con
+    'sample_rate' (0-1), 'duration_s' e 'interval_ms'
+    """
+    if not profiling.authorized():
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    try:
+        data = request.json or {}
+        result = profiling.start(
+            data.get('sample_rate', 0.1),
+            data.get('duration_s', 30),
+            data.get('interval_ms', profiling.DEFAULT_INTERVAL_MS)
+        )
+        return jsonify(result)
+    
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/profiling/stop', methods=['POST'])
+def profiling_stop():
+    """
+    Interrompe la sessione di profiling attiva
+    """
+    if not profiling.authorized():
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    return jsonify(profiling.stop())
+
+@app.route('/profiling/status', methods=['GET'])
+def profiling_status():
+    """
+    Stato e ripartizione dei tempi della sessione attiva o dell'ultima conclusa
+    """
+    if not profiling.authorized():
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    return jsonify(profiling.status())
+
+@app.route('/profiling/collapsed', methods=['GET'])
+def profiling_collapsed():
+    """
+    Stack aggregati in formato collapsed (input di flamegraph.pl / speedscope)
+    """
+    if not profiling.authorized():
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    return profiling.collapsed(), 200, {'Content-Type': 'text/plain; charset=utf-8'}
+
 # Per addestramento manuale dei modelli
 @app.route('/train', methods=['POST'])
 def train_models():
@@ -105,23 +354,31 @@ def train_models():
     try:
         data = request.json or {}
         models_to_train = data.get('models', ['dynamic_pricing', 'predictive_churn', 'user_clustering'])
+        tune = bool(data.get('tune', False))
+        compress = bool(data.get('compress', False))
+        warm_start = bool(data.get('warm_start', True))
         
         results = {}
         
         if 'dynamic_pricing' in models_to_train:
             print("Addestramento modello dynamic pricing...")
-            dynamic_pricing.train_model()
-            results['dynamic_pricing'] = 'trained'
+            model_data = dynamic_pricing.train_model(tune=tune, compress=compress, warm_start=warm_start)
+            results['dynamic_pricing'] = 'tuned' if tune else model_data['training_cache']['mode']
         
         if 'predictive_churn' in models_to_train:
             print("Addestramento modello predictive churn...")
-            predictive_churn.train_model()
-            results['predictive_churn'] = 'trained'
+            model_data = predictive_churn.train_model(tune=tune, warm_start=warm_start)
+            results['predictive_churn'] = 'tuned' if tune else model_data['training_cache']['mode']
         
         if 'user_clustering' in models_to_train:
             print("Addestramento modello user clustering...")
-            user_clustering.train_model()
-            results['user_clustering'] = 'trained'
+            model_data = user_clustering.train_model(tune=tune, warm_start=warm_start)
+            # Con il warm start gli ID dei cluster mantengono il loro significato e le
+            # analytics restano valide; l'indice dei simili viene sempre riallineato
+            if model_data['training_cache']['mode'] == 'cold':
+                cluster_analytics.reset_analytics()
+            results['user_clustering'] = 'tuned' if tune else model_data['training_cache']['mode']
+            results['similar_users_index'] = similar_users.refresh_index()
         
         return jsonify({
             'status': 'success',
@@ -0,0 +1,208 @@
+"""
+Scoring massivo offline per i modelli di machine learning
+Legge un file CSV o Parquet a blocchi, distribuisce i blocchi a un pool di
+processi (ogni worker carica il modello una sola volta) e scrive i risultati
+nell'ordine di ingresso con memoria limitata
+
+Esempio:
+    python ml/bulk_score.py annunci.csv prezzi.csv --model dynamic_pricing
+"""
+
+import os
+import sys
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+MODELS = ['dynamic_pricing', 'predictive_churn', 'user_clustering']
+
+# Righe per blocco
+DEFAULT_CHUNK_SIZE = 10000
+
+# Blocchi in volo per worker (limita la memoria occupata dai risultati in attesa)
+CHUNKS_PER_WORKER = 2
+
+# Modello caricato nel processo worker
+_worker_model = None
+
+def _init_worker(model_name, workers):
+    """
+    Inizializza il worker: applica il budget di thread e carica il modello una volta
+    """
+    global _worker_model
+
+    # Ogni worker riceve una quota dei core per i pool nativi
+    # (impostata solo nei worker: il processo principale non occupa un indice di pinning)
+    os.environ['ML_WORKERS'] = str(workers)
+
+    import thread_policy
+    thread_policy.reconfigure()
+
+    module = __import__(model_name)
+    _worker_model = (module, module.load_model())
+
+def _score_chunk(chunk):
+    """
+    Calcola le predizioni vettorizzate per un blocco di righe
+    """
+    module, model_data = _worker_model
+
+    if module.__name__ == 'dynamic_pricing':
+        return chunk.assign(
+            recommended_price_change_percentage=module.predict_price_changes(chunk, model_data)
+        )
+
+    if module.__name__ == 'predictive_churn':
+        churn_probability, risk_level = module.predict_churn_probabilities(chunk, model_data)
+        return chunk.assign(churn_probability=churn_probability, risk_level=risk_level)
+
+    cluster_ids, confidence = module.predict_user_clusters(chunk, model_data)
+    return chunk.assign(
+        cluster_id=cluster_ids,
+        cluster_name=[model_data['cluster_descriptions'][i] for i in cluster_ids],
+        confidence=confidence
+    )
+
+def _is_parquet(path):
+    return path.lower().endswith(('.parquet', '.pq'))
+
+def _check_format_support(*paths):
+    """
+    Verifica prima dello scoring che le dipendenze dei formati richiesti siano installate
+
+    Raises:
+        RuntimeError: se serve pyarrow (file Parquet) e non è disponibile
+    """
+    if any(_is_parquet(path) for path in paths):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise RuntimeError("I file Parquet richiedono pyarrow: installarlo con 'pip install pyarrow' oppure usare CSV")
+
+def _read_chunks(path, chunk_size):
+    """
+    Legge il file di input a blocchi di chunk_size righe
+    """
+    import pandas as pd
+
+    if _is_parquet(path):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_size)
+
+class _ChunkWriter:
+    """
+    Scrive i blocchi di risultati su CSV o Parquet in modo incrementale
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._parquet_writer = None
+        self._first = True
+
+    def write(self, chunk):
+        if _is_parquet(self.path):
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if self._parquet_writer is None:
+                self._parquet_writer = pq.ParquetWriter(self.path, table.schema)
+            self._parquet_writer.write_table(table)
+        else:
+            chunk.to_csv(self.path, mode='w' if self._first else 'a', header=self._first, index=False)
+        self._first = False
+
+    def close(self):
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+
+def bulk_score(input_path, output_path, model_name, chunk_size=DEFAULT_CHUNK_SIZE, workers=None, record_analytics=False):
+    """
+    Esegue lo scoring massivo di un file
+
+    Args:
+        input_path: File CSV o Parquet di annunci o utenti
+        output_path: File di output (stesso formato indicato dall'estensione)
+        model_name: Uno tra dynamic_pricing, predictive_churn, user_clustering
+        chunk_size: Righe per blocco
+        workers: Numero di processi (default: tutti i core)
+        record_analytics: Registra le assegnazioni nelle analytics dei cluster
+            (solo user_clustering, richiede la colonna 'user_id')
+
+    Returns:
+        Numero di righe elaborate
+
+    Raises:
+        RuntimeError: se il formato dei file richiede dipendenze non installate
+    """
+    if model_name not in MODELS:
+        raise ValueError(f"Modello non supportato: {model_name}")
+
+    # Fallisce subito invece che dopo aver elaborato il primo blocco
+    _check_format_support(input_path, output_path)
+
+    workers = workers or os.cpu_count() or 1
+
+    # Assicura che l'artefatto esista, così i worker non lo addestrano in parallelo
+    __import__(model_name).load_model()
+
+    # L'intero file è una sola run di scoring nelle analytics dei cluster
+    record_analytics = record_analytics and model_name == 'user_clustering'
+    if record_analytics:
+        import cluster_analytics
+        run_id = cluster_analytics.new_run_id()
+
+    writer = _ChunkWriter(output_path)
+    pending = deque()
+    rows = 0
+    start = time.time()
+
+    def _drain_one():
+        nonlocal rows
+        result = pending.popleft().result()
+        writer.write(result)
+        if record_analytics and 'user_id' in result:
+            cluster_analytics.record_frame(result, result['cluster_id'].values, run_id)
+        rows += len(result)
+        elapsed = time.time() - start
+        print(f"\r{rows} righe elaborate ({rows / max(elapsed, 1e-9):.0f} righe/s)", end='', file=sys.stderr, flush=True)
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(model_name, workers)) as pool:
+            for chunk in _read_chunks(input_path, chunk_size):
+                pending.append(pool.submit(_score_chunk, chunk))
+                # Attende il blocco più vecchio per mantenere ordine e memoria limitata
+                if len(pending) >= workers * CHUNKS_PER_WORKER:
+                    _drain_one()
+            while pending:
+                _drain_one()
+    finally:
+        writer.close()
+        if record_analytics:
+            cluster_analytics.sync()
+
+    elapsed = time.time() - start
+    print(f"\nScoring completato: {rows} righe in {elapsed:.1f}s con {workers} worker", file=sys.stderr)
+
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Scoring massivo offline dei modelli ML")
+    parser.add_argument('input', help="File CSV o Parquet di input")
+    parser.add_argument('output', help="File CSV o Parquet di output")
+    parser.add_argument('--model', required=True, choices=MODELS, help="Modello da utilizzare")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="Righe per blocco")
+    parser.add_argument('--workers', type=int, default=None, help="Numero di processi (default: tutti i core)")
+    parser.add_argument('--record-analytics', action='store_true', help="Aggiorna le analytics dei cluster (user_clustering)")
+    args = parser.parse_args()
+
+    try:
+        bulk_score(args.input, args.output, args.model, args.chunk_size, args.workers, args.record_analytics)
+    except RuntimeError as e:
+        sys.exit(f"Errore: {e}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+"""
+Analytics incrementali dei segmenti utente
+Mantiene per ogni cluster conteggi, somme e somme dei quadrati delle feature
+e le transizioni tra cluster degli utenti da una run di scoring alla
+successiva, così il riepilogo dei segmenti si calcola in tempo costante
+senza rivalutare tutta la base utenti.
+
+Lo stato è un database SQLite condiviso tra i processi (worker dell'API e
+scoring massivo). Ogni processo accoda in memoria le assegnazioni servite e
+le sincronizza fuori dal percorso delle richieste con una sola transazione:
+aggiorna solo le righe degli utenti toccati (ultimo cluster, run e vettore)
+e somma ai totali per cluster e alla matrice delle transizioni i delta
+calcolati, senza mai riscrivere lo stato per intero.
+"""
+
+import os
+import json
+import time
+import uuid
+import atexit
+import sqlite3
+import threading
+import traceback
+import numpy as np
+
+import user_clustering
+
+DB_PATH = os.path.join(os.path.dirname(__file__), 'models/cluster_analytics.sqlite')
+
+# Intervallo tra due sincronizzazioni delle assegnazioni in coda
+SYNC_INTERVAL_S = 10.0
+
+# Le assegnazioni servite dall'API nello stesso periodo formano una sola run di
+# scoring: un utente valutato più volte nello stesso giorno non genera transizioni
+API_RUN_PERIOD_S = 86400
+
+# Utenti per query IN durante la lettura delle assegnazioni precedenti
+LOOKUP_CHUNK = 500
+
+# Assegnazioni non ancora sincronizzate: (run_id, user_ids, valori, cluster)
+_pending = []
+_pending_lock = threading.Lock()
+_sync_lock = threading.Lock()
+
+# Pid del processo che ha avviato il thread di sincronizzazione (riavviato dopo un fork)
+_syncer_pid = None
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY, cluster INTEGER, run_id TEXT, vector BLOB
+);
+CREATE TABLE IF NOT EXISTS clusters (
+    cluster INTEGER PRIMARY KEY, count INTEGER, sums BLOB, sumsq BLOB
+);
+CREATE TABLE IF NOT EXISTS transitions (
+    source INTEGER, target INTEGER, count INTEGER, PRIMARY KEY (source, target)
+);
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY, assignments INTEGER, last_update REAL
+);
+"""
+
+def _connect():
+    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+def _model_layout():
+    """
+    Feature e numero di cluster del modello corrente
+    """
+    return user_clustering.load_model()['features'], user_clustering.N_CLUSTERS
+
+def _clear(conn, features, n_clusters):
+    """
+    Azzera lo stato e registra il modello a cui si riferisce (dentro una transazione)
+    """
+    for table in ('users', 'clusters', 'transitions', 'runs', 'meta'):
+        conn.execute(f'DELETE FROM {table}')
+    conn.execute("INSERT INTO meta VALUES ('layout', ?)", (json.dumps([features, n_clusters]),))
+
+def _ensure_layout(conn, features, n_clusters):
+    """
+    Azzera lo stato se è stato costruito per un modello con feature o cluster diversi
+    """
+    row = conn.execute("SELECT value FROM meta WHERE key = 'layout'").fetchone()
+    if row is None or json.loads(row[0]) != [features, n_clusters]:
+        if row is not None:
+            print("Analytics dei cluster non allineate al modello: verranno ricostruite")
+        _clear(conn, features, n_clusters)
+
+def api_run_id():
+    """
+    Run di scoring a cui appartengono le assegnazioni servite ora dall'API
+    """
+    return f'api-{int(time.time() // API_RUN_PERIOD_S)}'
+
+def new_run_id(prefix='bulk'):
+    """
+    Identificativo di una nuova run di scoring (es. un file di scoring massivo)
+    """
+    return f'{prefix}-{uuid.uuid4().hex[:12]}'
+
+def _previous_assignments(conn, user_ids):
+    """
+    Ultima assegnazione salvata per ogni utente: user_id -> (cluster, run_id, vettore)
+    """
+    previous = {}
+    for start in range(0, len(user_ids), LOOKUP_CHUNK):
+        chunk = user_ids[start:start + LOOKUP_CHUNK]
+        rows = conn.execute(
+            f"SELECT user_id, cluster, run_id, vector FROM users WHERE user_id IN ({','.join('?' * len(chunk))})",
+            chunk
+        )
+        for user_id, cluster, run_id, vector in rows:
+            previous[user_id] = (cluster, run_id, np.frombuffer(vector, dtype=np.float64))
+    return previous
+
+def _apply(conn, pending, n_features, n_clusters):
+    """
+    Applica le assegnazioni in coda: aggiorna gli utenti toccati e somma i delta
+    """
+    counts = np.zeros(n_clusters, dtype=np.int64)
+    sums = np.zeros((n_clusters, n_features), dtype=np.float64)
+    sumsq = np.zeros((n_clusters, n_features), dtype=np.float64)
+    transitions = np.zeros((n_clusters, n_clusters), dtype=np.int64)
+    runs = {}
+
+    user_ids = list({user_id for _, batch_ids, _, _ in pending for user_id in batch_ids})
+    current = _previous_assignments(conn, user_ids)
+
+    for run_id, batch_ids, values, cluster_ids in pending:
+        for user_id, vector, cluster_id in zip(batch_ids, values, cluster_ids):
+            cluster_id = int(cluster_id)
+            previous = current.get(user_id)
+            if previous is not None:
+                previous_cluster, previous_run, previous_vector = previous
+                counts[previous_cluster] -= 1
+                sums[previous_cluster] -= previous_vector
+                sumsq[previous_cluster] -= previous_vector ** 2
+                # Transizione solo tra run diverse, non tra valutazioni della stessa run
+                if previous_run != run_id:
+                    transitions[previous_cluster, cluster_id] += 1
+
+            counts[cluster_id] += 1
+            sums[cluster_id] += vector
+            sumsq[cluster_id] += vector ** 2
+            current[user_id] = (cluster_id, run_id, vector)
+        runs[run_id] = runs.get(run_id, 0) + len(batch_ids)
+
+    conn.executemany(
+        'INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?)',
+        [
+            (user_id, cluster_id, run_id, np.ascontiguousarray(vector, dtype=np.float64).tobytes())
+            for user_id, (cluster_id, run_id, vector) in current.items()
+        ]
+    )
+
+    # Somma dei delta ai totali per cluster
+    stored = {
+        cluster: (count, np.frombuffer(s, dtype=np.float64), np.frombuffer(sq, dtype=np.float64))
+        for cluster, count, s, sq in conn.execute('SELECT cluster, count, sums, sumsq FROM clusters')
+    }
+    zeros = np.zeros(n_features, dtype=np.float64)
+    rows = []
+    for cluster in np.flatnonzero((counts != 0) | np.any(sums != 0, axis=1)):
+        count, s, sq = stored.get(int(cluster), (0, zeros, zeros))
+        rows.append((int(cluster), int(count + counts[cluster]), (s + sums[cluster]).tobytes(), (sq + sumsq[cluster]).tobytes()))
+    conn.executemany('INSERT OR REPLACE INTO clusters VALUES (?, ?, ?, ?)', rows)
+
+    conn.executemany(
+        'INSERT INTO transitions VALUES (?, ?, ?) '
+        'ON CONFLICT (source, target) DO UPDATE SET count = count + excluded.count',
+        [(int(i), int(j), int(transitions[i, j])) for i, j in zip(*np.nonzero(transitions))]
+    )
+    now = time.time()
+    conn.executemany(
+        'INSERT INTO runs VALUES (?, ?, ?) '
+        'ON CONFLICT (run_id) DO UPDATE SET assignments = assignments + excluded.assignments, last_update = excluded.last_update',
+        [(run_id, assignments, now) for run_id, assignments in runs.items()]
+    )
+
+def sync():
+    """
+    Salva nel database le assegnazioni in coda del processo (una transazione)
+    """
+    global _pending
+
+    with _sync_lock:
+        with _pending_lock:
+            pending, _pending = _pending, []
+        if not pending:
+            return
+
+        features, n_clusters = _model_layout()
+        try:
+            conn = _connect()
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                _ensure_layout(conn, features, n_clusters)
+                _apply(conn, pending, len(features), n_clusters)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            finally:
+                conn.close()
+        except Exception:
+            # Le assegnazioni restano in coda per il prossimo tentativo
+            with _pending_lock:
+                _pending = pending + _pending
+            raise
+
+def _start_syncer():
+    """
+    Avvia (una volta per processo) il thread che sincronizza periodicamente le assegnazioni
+    """
+    global _syncer_pid
+
+    if _syncer_pid == os.getpid():
+        return
+    _syncer_pid = os.getpid()
+
+    def _run():
+        while True:
+            time.sleep(SYNC_INTERVAL_S)
+            try:
+                sync()
+            except Exception:
+                traceback.print_exc()
+
+    threading.Thread(target=_run, name='ml-cluster-analytics-sync', daemon=True).start()
+
+def _sync_at_exit():
+    # Un processo figlio creato con fork non deve sincronizzare la coda ereditata dal padre
+    if _pending and _syncer_pid == os.getpid():
+        try:
+            sync()
+        except Exception:
+            traceback.print_exc()
+
+atexit.register(_sync_at_exit)
+
+def reset_analytics():
+    """
+    Azzera le analytics (da chiamare dopo il riaddestramento del clustering da zero,
+    perché gli ID dei cluster cambiano significato)
+    """
+    global _pending
+
+    features, n_clusters = _model_layout()
+    with _sync_lock:
+        with _pending_lock:
+            _pending = []
+        conn = _connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            _clear(conn, features, n_clusters)
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+
+def record(user_ids, values, cluster_ids, run_id):
+    """
+    Accoda assegnazioni per la sincronizzazione (nessun accesso al disco)
+
+    Args:
+        user_ids: Lista di ID utente
+        values: Array (n, feature) nell'ordine delle feature del clustering
+        cluster_ids: Cluster assegnati
+        run_id: Run di scoring a cui appartengono le assegnazioni
+    """
+    with _pending_lock:
+        _pending.append((
+            run_id,
+            [str(user_id) for user_id in user_ids],
+            np.asarray(values, dtype=np.float64),
+            np.asarray(cluster_ids, dtype=np.int32)
+        ))
+        _start_syncer()
+
+def record_assignments(users_data, cluster_ids):
+    """
+    Registra le assegnazioni servite dall'API per utenti con 'user_id' (gli altri vengono ignorati)
+
+    La registrazione è best-effort: un errore viene solo loggato, così non
+    fa fallire la predizione già calcolata.
+
+    Args:
+        users_data: Lista di dizionari con 'user_id' e le feature del clustering
+        cluster_ids: Cluster assegnati, nello stesso ordine
+    """
+    try:
+        rows = [(user, cluster_id) for user, cluster_id in zip(users_data, cluster_ids) if user.get('user_id') is not None]
+        if not rows:
+            return
+
+        features, _ = _model_layout()
+        values = np.array([
+            [float(user.get(feature) or 0) for feature in features]
+            for user, _ in rows
+        ])
+        record([user['user_id'] for user, _ in rows], values, [cluster_id for _, cluster_id in rows], api_run_id())
+    except Exception:
+        traceback.print_exc()
+
+def record_frame(users_df, cluster_ids, run_id):
+    """
+    Registra un blocco di scoring massivo (DataFrame con colonna 'user_id')
+    """
+    features, _ = _model_layout()
+    values = users_df.reindex(columns=features).fillna(0).values
+    record(users_df['user_id'].tolist(), values, cluster_ids, run_id)
+
+def cluster_summary():
+    """
+    Riepilogo dei segmenti per la dashboard
+
+    Legge solo i totali per cluster e la matrice delle transizioni, quindi il
+    costo non dipende dal numero di utenti. Le assegnazioni in coda del
+    processo corrente vengono sincronizzate prima; quelle degli altri processi
+    compaiono entro SYNC_INTERVAL_S.
+    """
+    sync()
+    features, n_clusters = _model_layout()
+
+    counts = np.zeros(n_clusters, dtype=np.int64)
+    sums = np.zeros((n_clusters, len(features)), dtype=np.float64)
+    sumsq = np.zeros((n_clusters, len(features)), dtype=np.float64)
+    transitions = np.zeros((n_clusters, n_clusters), dtype=np.int64)
+
+    conn = _connect()
+    try:
+        conn.execute('BEGIN')
+        layout = conn.execute("SELECT value FROM meta WHERE key = 'layout'").fetchone()
+        aligned = layout is not None and json.loads(layout[0]) == [features, n_clusters]
+        if aligned:
+            for cluster, count, s, sq in conn.execute('SELECT cluster, count, sums, sumsq FROM clusters'):
+                counts[cluster] = count
+                sums[cluster] = np.frombuffer(s, dtype=np.float64)
+                sumsq[cluster] = np.frombuffer(sq, dtype=np.float64)
+            for source, target, count in conn.execute('SELECT source, target, count FROM transitions'):
+                transitions[source, target] = count
+            n_runs, last_update = conn.execute('SELECT COUNT(*), MAX(last_update) FROM runs').fetchone()
+        else:
+            n_runs, last_update = 0, None
+        conn.execute('COMMIT')
+    finally:
+        conn.close()
+
+    total = int(counts.sum())
+    safe_counts = np.maximum(counts, 1)[:, np.newaxis]
+    means = sums / safe_counts
+    stds = np.sqrt(np.maximum(sumsq / safe_counts - means ** 2, 0))
+
+    rescored = int(transitions.sum())
+    moved = rescored - int(np.trace(transitions))
+
+    return {
+        'total_users': total,
+        'scoring_runs': n_runs,
+        'last_update': last_update,
+        'clusters': [
+            {
+                'cluster_id': i,
+                'cluster_name': user_clustering.CLUSTER_DESCRIPTIONS.get(i, str(i)),
+                'size': int(counts[i]),
+                'share': round(float(counts[i]) / total, 4) if total else 0.0,
+                'feature_means': {f: round(float(v), 4) for f, v in zip(features, means[i])},
+                'feature_stds': {f: round(float(v), 4) for f, v in zip(features, stds[i])}
+            }
+            for i in range(n_clusters)
+        ],
+        # Conteggi per coppia (cluster nella run precedente, cluster nella run successiva)
+        'run_transitions': transitions.tolist(),
+        'cross_run_rescores': rescored,
+        'cross_run_moves': moved,
+        'cross_run_move_rate': round(moved / rescored, 4) if rescored else 0.0
+    }
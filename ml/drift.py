@@ -0,0 +1,298 @@
+"""
+Monitoraggio della deriva degli input dei modelli
+All'addestramento ogni artefatto salva un istogramma di riferimento per feature
+(bin sui quantili del training set); in produzione ogni processo aggiorna
+istogrammi con gli stessi bin, a memoria costante e sommabili tra processi
+"""
+
+import os
+import glob
+import uuid
+import atexit
+import fcntl
+import hashlib
+import threading
+import numpy as np
+
+DRIFT_DIR = os.path.join(os.path.dirname(__file__), 'models/drift')
+
+# Numero di bin per feature
+N_BINS = 10
+
+# Intervallo tra due salvataggi su disco degli istogrammi del processo
+# (eseguiti da un thread in background, mai durante le richieste)
+FLUSH_INTERVAL_S = 5.0
+
+# Nome del file che accumula i conteggi dei processi terminati
+MERGED_SUFFIX = 'merged'
+
+# Soglie PSI (population stability index)
+PSI_MODERATE = 0.1
+PSI_DRIFT = 0.25
+
+# Osservazioni minime prima di dare un giudizio
+MIN_OBSERVATIONS = 100
+
+# Smussamento per evitare log(0) nei bin vuoti
+EPSILON = 1e-4
+
+# Istogrammi del processo corrente per modello
+_monitors = {}
+
+# Identità del processo corrente (pid, token): il token distingue un pid riutilizzato
+_process_id = None
+_flusher_lock = threading.Lock()
+
+def _process_tag():
+    """
+    Suffisso dei file del processo corrente, rigenerato dopo un fork
+    """
+    global _process_id
+
+    pid = os.getpid()
+    if _process_id is None or _process_id[0] != pid:
+        with _flusher_lock:
+            if _process_id is None or _process_id[0] != pid:
+                _process_id = (pid, uuid.uuid4().hex[:8])
+                _start_flusher()
+    return f'{_process_id[0]}-{_process_id[1]}'
+
+def _start_flusher():
+    """
+    Avvia il thread che salva periodicamente gli istogrammi del processo
+    """
+    stop = threading.Event()
+
+    def _run():
+        while not stop.wait(FLUSH_INTERVAL_S):
+            flush_all()
+
+    threading.Thread(target=_run, name='ml-drift-flush', daemon=True).start()
+
+def flush_all():
+    """
+    Salva su disco gli istogrammi di tutti i modelli del processo
+    """
+    for monitor in list(_monitors.values()):
+        monitor.flush()
+
+atexit.register(flush_all)
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _bin_indices(values, edges):
+    """
+    Indice del bin di ogni valore: values (n, f), edges (f, N_BINS - 1) -> (n, f)
+    """
+    return (values[:, :, np.newaxis] > edges[np.newaxis, :, :]).sum(axis=2)
+
+def build_reference(X):
+    """
+    Costruisce il profilo di riferimento delle feature dai dati di addestramento
+
+    Args:
+        X: DataFrame di addestramento (prima della standardizzazione)
+
+    Returns:
+        Dizionario con nomi delle feature, bordi dei bin e distribuzione di riferimento
+    """
+    values = np.asarray(X, dtype=np.float64)
+    quantiles = np.linspace(0, 1, N_BINS + 1)[1:-1]
+    edges = np.quantile(values, quantiles, axis=0).T
+
+    bins = _bin_indices(values, edges)
+    counts = np.zeros((values.shape[1], N_BINS), dtype=np.int64)
+    for feature in range(values.shape[1]):
+        counts[feature] = np.bincount(bins[:, feature], minlength=N_BINS)
+
+    return {
+        'features': list(X.columns),
+        'edges': edges,
+        'reference': counts / len(values),
+        'signature': hashlib.sha1(edges.tobytes()).hexdigest()[:12]
+    }
+
+class DriftMonitor:
+    """
+    Istogrammi live delle feature di un modello nel processo corrente
+    """
+
+    def __init__(self, model_name, reference):
+        self.model_name = model_name
+        self.signature = reference['signature']
+        self.edges = reference['edges']
+        self.counts = np.zeros((len(reference['features']), N_BINS), dtype=np.int64)
+        self._rows = np.arange(len(reference['features']))
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def update(self, values):
+        """
+        Aggiunge una o più righe di feature agli istogrammi
+        """
+        bins = _bin_indices(np.atleast_2d(np.asarray(values, dtype=np.float64)), self.edges)
+        with self._lock:
+            if len(bins) == 1:
+                self.counts[self._rows, bins[0]] += 1
+            else:
+                np.add.at(self.counts, (np.broadcast_to(self._rows, bins.shape), bins), 1)
+            self._dirty = True
+
+    def _path(self):
+        return os.path.join(DRIFT_DIR, f'{self.model_name}.{self.signature}.{_process_tag()}.npy')
+
+    def flush(self):
+        """
+        Salva gli istogrammi del processo su disco per il merge tra worker
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            counts = self.counts.copy()
+            self._dirty = False
+
+        os.makedirs(DRIFT_DIR, exist_ok=True)
+        path = self._path()
+        tmp_path = path + '.tmp.npy'
+        np.save(tmp_path, counts)
+        os.replace(tmp_path, path)
+
+def observe(model_name, model_data, values):
+    """
+    Registra gli input serviti da un modello
+
+    Args:
+        model_name: Nome del modello
+        model_data: Artefatto caricato (deve contenere 'drift_reference')
+        values: Righe di feature nell'ordine di model_data['features']
+    """
+    reference = model_data.get('drift_reference')
+    if reference is None:
+        return
+
+    monitor = _monitors.get(model_name)
+    if monitor is None or monitor.signature != reference['signature']:
+        _process_tag()
+        monitor = DriftMonitor(model_name, reference)
+        _monitors[model_name] = monitor
+
+    monitor.update(values)
+
+def _compact(model_name, signature):
+    """
+    Somma i file dei processi terminati nel file cumulativo e li rimuove
+    (da chiamare con il lock dei file del modello)
+    """
+    merged_path = os.path.join(DRIFT_DIR, f'{model_name}.{signature}.{MERGED_SUFFIX}.npy')
+
+    dead = []
+    for path in glob.glob(os.path.join(DRIFT_DIR, f'{model_name}.{signature}.*.npy')):
+        tag = os.path.basename(path).split('.')[2]
+        if '.tmp' in path or tag == MERGED_SUFFIX:
+            continue
+        try:
+            pid = int(tag.split('-')[0])
+        except ValueError:
+            continue
+        if not _pid_alive(pid):
+            dead.append(path)
+
+    if not dead:
+        return
+
+    total = np.load(merged_path) if os.path.exists(merged_path) else None
+    for path in dead:
+        counts = np.load(path)
+        total = counts if total is None else total + counts
+
+    tmp_path = merged_path + '.tmp.npy'
+    np.save(tmp_path, total)
+    os.replace(tmp_path, merged_path)
+    for path in dead:
+        os.remove(path)
+
+def merged_counts(model_name, signature):
+    """
+    Somma gli istogrammi salvati da tutti i processi per un modello
+
+    I file dei processi terminati vengono prima accorpati nel file cumulativo;
+    accorpamento e lettura avvengono sotto lock esclusivo, così due processi
+    non contano due volte gli stessi file.
+
+    Returns:
+        Array (feature, bin) con i conteggi totali, None se non ci sono dati
+    """
+    monitor = _monitors.get(model_name)
+    if monitor is not None:
+        monitor.flush()
+
+    os.makedirs(DRIFT_DIR, exist_ok=True)
+    with open(os.path.join(DRIFT_DIR, f'{model_name}.{signature}.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        _compact(model_name, signature)
+
+        total = None
+        for path in glob.glob(os.path.join(DRIFT_DIR, f'{model_name}.{signature}.*.npy')):
+            if '.tmp' in path:
+                continue
+            counts = np.load(path)
+            total = counts if total is None else total + counts
+    return total
+
+def population_stability_index(reference, observed):
+    """
+    PSI per feature tra distribuzione di riferimento e distribuzione osservata
+    """
+    observed = observed / np.maximum(observed.sum(axis=1, keepdims=True), 1)
+    reference = np.clip(reference, EPSILON, None)
+    observed = np.clip(observed, EPSILON, None)
+    return ((observed - reference) * np.log(observed / reference)).sum(axis=1)
+
+def _status(psi):
+    if psi >= PSI_DRIFT:
+        return 'drift'
+    if psi >= PSI_MODERATE:
+        return 'moderate'
+    return 'stable'
+
+def drift_report(model_name, model_data):
+    """
+    Report di deriva per un modello
+
+    Args:
+        model_name: Nome del modello
+        model_data: Artefatto caricato
+
+    Returns:
+        Dizionario con osservazioni, PSI e stato per feature
+    """
+    reference = model_data.get('drift_reference')
+    if reference is None:
+        return {'available': False, 'reason': 'Artefatto senza profilo di riferimento: riaddestrare il modello'}
+
+    counts = merged_counts(model_name, reference['signature'])
+    observations = 0 if counts is None else int(counts[0].sum())
+    if observations < MIN_OBSERVATIONS:
+        return {'available': False, 'observations': observations, 'reason': 'Osservazioni insufficienti'}
+
+    psi = population_stability_index(reference['reference'], counts)
+    features = {
+        feature: {'psi': round(float(value), 4), 'status': _status(value)}
+        for feature, value in zip(reference['features'], psi)
+    }
+
+    return {
+        'available': True,
+        'observations': observations,
+        'max_psi': round(float(psi.max()), 4),
+        'status': _status(psi.max()),
+        'retrain_recommended': bool(psi.max() >= PSI_DRIFT),
+        'features': features
+    }
@@ -4,21 +4,148 @@ Utilizza dati storici sui prezzi per suggerire variazioni percentuali
 """
 
 import os
+import copy
+import time
+import pickle
+import math
 import numpy as np
 import pandas as pd
 from sklearn.ensemble import RandomForestRegressor
-from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
+from sklearn.metrics import r2_score
 import joblib
 
+import tuning
+import training_cache
+import thread_policy
+import drift
+
 MODEL_PATH = os.path.join(os.path.dirname(__file__), 'models/dynamic_pricing_model.joblib')
+COMPRESSED_MODEL_PATH = os.path.join(os.path.dirname(__file__), 'models/dynamic_pricing_model_compressed.joblib')
+
+# Se impostata a 1, il servizio usa l'artefatto compresso quando disponibile
+USE_COMPRESSED = os.environ.get('ML_PRICING_COMPRESSED') == '1'
+
+# Perdita massima di R² (in punti assoluti) accettata dalla compressione
+MAX_R2_LOSS = 0.005
+
+# Profondità massime provate dalla compressione (None = alberi completi)
+COMPRESSION_DEPTHS = [4, 6, 8, 10, 12, 16, None]
+
+# Numero massimo di punti valutabili in un singolo sweep what-if
+MAX_SWEEP_POINTS = 10000
+
+# Iperparametri predefiniti della foresta
+MODEL_PARAMS = {'n_estimators': 100, 'random_state': 42}
+
+# Griglia esplorata in modalità tuning
+TUNING_GRID = {
+    'model__n_estimators': [50, 100, 200],
+    'model__max_depth': [None, 8, 16],
+    'model__min_samples_leaf': [1, 2, 4],
+    'model__max_features': [1.0, 0.5]
+}
+
+def _measure_forest(model, X_test):
+    """
+    Misura dimensione serializzata e latenza di predizione di una foresta
+    """
+    single_row = X_test[:1]
+    timings = []
+    for _ in range(20):
+        start = time.perf_counter()
+        model.predict(single_row)
+        timings.append(time.perf_counter() - start)
+    
+    start = time.perf_counter()
+    model.predict(X_test)
+    batch_time = time.perf_counter() - start
+    
+    return {
+        'n_estimators': len(model.estimators_),
+        'max_depth': max(tree.get_depth() for tree in model.estimators_),
+        'size_kb': round(len(pickle.dumps(model)) / 1024, 1),
+        'single_prediction_ms': round(float(np.median(timings)) * 1000, 3),
+        'batch_prediction_ms': round(batch_time * 1000, 3)
+    }
+
+def compress_forest(model, model_params, X_train, y_train, X_test, y_test, max_r2_loss=MAX_R2_LOSS):
+    """
+    Cerca la foresta più piccola e meno profonda entro il budget di perdita di R²
+    
+    Per ogni profondità massima riaddestra la foresta e valuta in un colpo solo
+    tutte le foreste formate dai primi k alberi (media cumulativa delle
+    predizioni dei singoli alberi), scegliendo la combinazione con il minor
+    costo stimato (alberi x profondità media).
+    
+    Args:
+        model: Foresta completa già addestrata
+        model_params: Iperparametri usati per la foresta completa
+        X_train, y_train: Split di addestramento standardizzato
+        X_test, y_test: Split di test standardizzato
+        max_r2_loss: Perdita massima di R² ammessa rispetto alla foresta completa
+    
+    Returns:
+        La foresta compressa e il report del compromesso dimensione/latenza/accuratezza
+    """
+    y_test = np.asarray(y_test)
+    baseline_score = r2_score(y_test, model.predict(X_test))
+    target_score = baseline_score - max_r2_loss
+    total_variance = ((y_test - y_test.mean()) ** 2).sum()
+    
+    best = None
+    for depth in COMPRESSION_DEPTHS:
+        candidate = model if depth is None and model_params.get('max_depth') is None else \
+            RandomForestRegressor(**{**model_params, 'max_depth': depth}).fit(X_train, y_train)
+        
+        # R² di tutte le foreste formate dai primi k alberi
+        tree_predictions = np.stack([tree.predict(X_test) for tree in candidate.estimators_])
+        cumulative = np.cumsum(tree_predictions, axis=0) / np.arange(1, len(tree_predictions) + 1)[:, np.newaxis]
+        scores = 1 - ((cumulative - y_test) ** 2).sum(axis=1) / total_variance
+        
+        feasible = np.flatnonzero(scores >= target_score)
+        if len(feasible) == 0:
+            continue
+        
+        n_trees = int(feasible[0]) + 1
+        mean_depth = np.mean([tree.get_depth() for tree in candidate.estimators_[:n_trees]])
+        cost = n_trees * mean_depth
+        if best is None or cost < best[0]:
+            best = (cost, candidate, n_trees, depth, float(scores[n_trees - 1]))
+    
+    if best is None:
+        # Nessuna combinazione più piccola rispetta il budget: si mantiene la foresta completa
+        best = (None, model, len(model.estimators_), model_params.get('max_depth'), baseline_score)
+    
+    _, candidate, n_trees, depth, score = best
+    # Copia superficiale: la foresta completa resta intatta
+    compressed = copy.copy(candidate)
+    compressed.estimators_ = candidate.estimators_[:n_trees]
+    compressed.n_estimators = n_trees
+    
+    report = {
+        'max_r2_loss': max_r2_loss,
+        'full': {'r2': round(float(baseline_score), 4), **_measure_forest(model, X_test)},
+        'compressed': {'r2': round(score, 4), **_measure_forest(compressed, X_test)}
+    }
+    report['size_ratio'] = round(report['full']['size_kb'] / max(report['compressed']['size_kb'], 1e-9), 2)
+    report['speedup'] = round(report['full']['batch_prediction_ms'] / max(report['compressed']['batch_prediction_ms'], 1e-9), 2)
+    
+    print(f"Compressione foresta: {report['full']['n_estimators']} -> {n_trees} alberi, profondità massima {depth}, "
+          f"R² {report['full']['r2']:.4f} -> {report['compressed']['r2']:.4f}, "
+          f"{report['size_ratio']}x più piccola, {report['speedup']}x più veloce")
+    
+    return compressed, report
 
-def train_model(data_path=None):
+def train_model(data_path=None, tune=False, compress=False, warm_start=True):
     """
     Addestra il modello di dynamic pricing utilizzando dati storici
     
     Args:
         data_path: Percorso del file CSV con i dati storici (opzionale)
+        tune: Se True, cerca gli iperparametri con cross-validation prima dell'addestramento
+        compress: Se True, salva anche un artefatto compresso (meno alberi e meno profondi)
+        warm_start: Se True, riprende il modello precedente quando i dati sono solo cresciuti
     
     Returns:
         Il modello addestrato
@@ -99,17 +226,47 @@ def train_model(data_path=None):
     X = data.drop('optimal_price_change', axis=1)
     y = data['optimal_price_change']
     
-    # Divisione train/test
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    # Dati standardizzati e divisione train/test dalla cache (solo le righe nuove vengono elaborate)
+    training = training_cache.load_training_data('dynamic_pricing', X, source=data)
+    scaler = training['scaler']
+    X_train_scaled = training['X'][training['train_idx']]
+    X_test_scaled = training['X'][training['test_idx']]
+    X_train = X.iloc[training['train_idx']]
+    y_train = y.values[training['train_idx']]
+    y_test = y.values[training['test_idx']]
     
-    # Standardizzazione
-    scaler = StandardScaler()
-    X_train_scaled = scaler.fit_transform(X_train)
-    X_test_scaled = scaler.transform(X_test)
+    # Ricerca degli iperparametri (opzionale)
+    model_params = dict(MODEL_PARAMS)
+    tuning_report = None
+    if tune:
+        best_params, tuning_report = tuning.tune_hyperparameters(
+            'dynamic_pricing',
+            [('scaler', StandardScaler()), ('model', RandomForestRegressor(**MODEL_PARAMS))],
+            TUNING_GRID,
+            X_train,
+            y_train,
+            scoring='r2'
+        )
+        model_params.update(best_params['model'])
     
-    # Addestramento del modello
-    model = RandomForestRegressor(n_estimators=100, random_state=42)
-    model.fit(X_train_scaled, y_train)
+    # Ripresa del modello precedente: nuovi alberi in proporzione alle righe aggiunte
+    previous = training_cache.previous_artifact(MODEL_PATH, training) if warm_start and not tune else None
+    if previous is not None:
+        model = previous['model']
+        info = previous['training_cache']
+        model_params = {**model.get_params(), 'n_estimators': info['base_estimators'], 'warm_start': False}
+        extra = training_cache.extra_estimators(info['base_estimators'], training['n_rows'] - info['n_rows'], info['n_rows'])
+        if extra:
+            print(f"Dynamic Pricing Model: warm start con {extra} nuovi alberi")
+            model.set_params(warm_start=True, n_estimators=len(model.estimators_) + extra)
+            model.fit(X_train_scaled, y_train)
+            model.set_params(warm_start=False)
+        cache_info = training_cache.artifact_info(training, 'warm' if extra else 'unchanged', info['base_estimators'])
+    else:
+        # Addestramento del modello da zero
+        model = RandomForestRegressor(**model_params)
+        model.fit(X_train_scaled, y_train)
+        cache_info = training_cache.artifact_info(training, 'cold', model_params['n_estimators'])
     
     # Valutazione
     train_score = model.score(X_train_scaled, y_train)
@@ -121,27 +278,64 @@ def train_model(data_path=None):
     model_data = {
         'model': model,
         'scaler': scaler,
-        'features': list(X.columns)
+        'features': list(X.columns),
+        'drift_reference': drift.build_reference(X_train),
+        'training_cache': cache_info
     }
     
+    if tuning_report is not None:
+        tuning_report['test_score'] = float(test_score)
+        tuning.save_report('dynamic_pricing', tuning_report)
+        model_data['tuning'] = tuning_report
+    
     os.makedirs(os.path.dirname(MODEL_PATH), exist_ok=True)
     joblib.dump(model_data, MODEL_PATH)
     
+    # Artefatto alternativo compresso (opzionale)
+    if compress:
+        compressed, compression_report = compress_forest(
+            model, model_params, X_train_scaled, y_train, X_test_scaled, y_test
+        )
+        joblib.dump({**model_data, 'model': compressed, 'compression': compression_report}, COMPRESSED_MODEL_PATH)
+        model_data['compression'] = compression_report
+    elif cache_info['mode'] != 'unchanged' and os.path.exists(COMPRESSED_MODEL_PATH):
+        # L'artefatto compresso deriva dal modello precedente: non deve più essere servito
+        os.remove(COMPRESSED_MODEL_PATH)
+        print("Artefatto compresso rimosso: non corrisponde al nuovo modello")
+    
     return model_data
 
-def load_model():
+def load_model(compressed=None):
     """
     Carica il modello di dynamic pricing
     
+    Args:
+        compressed: Se True usa l'artefatto compresso quando disponibile
+            (default: variabile d'ambiente ML_PRICING_COMPRESSED)
+    
     Returns:
         Il modello e gli strumenti associati
     """
+    if compressed is None:
+        compressed = USE_COMPRESSED
+    
     # Se il modello non esiste, addestralo
     if not os.path.exists(MODEL_PATH):
-        return train_model()
+        train_model(compress=compressed)
+    
+    if compressed and os.path.exists(COMPRESSED_MODEL_PATH):
+        # Carica l'artefatto compresso
+        model_data = joblib.load(COMPRESSED_MODEL_PATH)
+    else:
+        # Carica il modello esistente
+        model_data = joblib.load(MODEL_PATH)
+    
+    # Le predizioni di singole righe restano su un thread: il dispatch di 100
+    # alberi sul pool di joblib costa più della predizione stessa
+    # (le predizioni batch usano thread_policy.batch_estimator)
+    thread_policy.apply_to_estimator(model_data['model'], n_jobs=1)
     
-    # Carica il modello esistente
-    return joblib.load(MODEL_PATH)
+    return model_data
 
 def predict_price_change(property_data):
     """
@@ -170,6 +364,9 @@ def predict_price_change(property_data):
     # Seleziona le feature nel giusto ordine
     property_df = property_df[features]
     
+    # Aggiorna gli istogrammi di deriva degli input
+    drift.observe('dynamic_pricing', model_data, property_df.values)
+    
     # Standardizza
     property_scaled = scaler.transform(property_df)
     
@@ -181,6 +378,158 @@ def predict_price_change(property_data):
         'confidence': 0.85  # Simulazione della confidenza
     }
 
+def predict_price_changes(properties_df, model_data=None):
+    """
+    Predice la variazione percentuale di prezzo per più proprietà in un'unica passata
+    
+    Args:
+        properties_df: DataFrame con una riga per proprietà
+        model_data: Modello già caricato (opzionale, altrimenti viene caricato)
+    
+    Returns:
+        Array numpy con le variazioni consigliate, arrotondate a 2 decimali
+    """
+    if model_data is None:
+        model_data = load_model()
+    features = model_data['features']
+    
+    # Seleziona le feature nel giusto ordine (mancanti a 0)
+    properties_df = properties_df.reindex(columns=features).fillna(0)
+    
+    # Standardizza e predice
+    properties_scaled = model_data['scaler'].transform(properties_df)
+    model = thread_policy.batch_estimator(model_data['model'], len(properties_df))
+    return np.round(model.predict(properties_scaled), 2)
+
+def predict_price_change_batch(properties_data):
+    """
+    Predice la variazione di prezzo per più proprietà con una sola predizione
+    
+    Args:
+        properties_data: Lista di dizionari con i dati delle proprietà
+    
+    Returns:
+        Lista di risultati nello stesso formato di predict_price_change
+    """
+    model_data = load_model()
+    properties_df = pd.DataFrame(properties_data).reindex(columns=model_data['features']).fillna(0)
+    
+    # Aggiorna gli istogrammi di deriva degli input
+    drift.observe('dynamic_pricing', model_data, properties_df.values)
+    
+    return [
+        {
+            'recommended_price_change_percentage': float(price_change),
+            'confidence': 0.85  # Simulazione della confidenza
+        }
+        for price_change in predict_price_changes(properties_df, model_data)
+    ]
+
+def _sweep_axis_values(feature, spec):
+    """
+    Converte la specifica di un asse dello sweep in un array di valori
+
+    Args:
+        feature: Nome della feature
+        spec: Lista di valori oppure dizionario {'min', 'max', 'steps'}
+
+    Returns:
+        Array numpy con i valori dell'asse (al massimo MAX_SWEEP_POINTS valori finiti)
+    """
+    if isinstance(spec, dict):
+        try:
+            start = float(spec['min'])
+            stop = float(spec['max'])
+            steps = int(spec.get('steps', 10))
+        except (KeyError, TypeError, ValueError, OverflowError):
+            raise ValueError(f"Specifica non valida per la feature '{feature}': servono 'min', 'max' e 'steps'")
+        if not (math.isfinite(start) and math.isfinite(stop)):
+            raise ValueError(f"Gli estremi della feature '{feature}' devono essere numeri finiti")
+        # Controllato prima di costruire l'asse, per non allocare griglie enormi
+        if not 1 <= steps <= MAX_SWEEP_POINTS:
+            raise ValueError(f"Il numero di passi per la feature '{feature}' deve essere compreso tra 1 e {MAX_SWEEP_POINTS}")
+        return np.linspace(start, stop, steps)
+
+    if isinstance(spec, (list, tuple)) and len(spec) > 0:
+        if len(spec) > MAX_SWEEP_POINTS:
+            raise ValueError(f"La feature '{feature}' ha più di {MAX_SWEEP_POINTS} valori")
+        # Niente None, booleani o stringhe: np.asarray li convertirebbe in NaN o numeri
+        if not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in spec):
+            raise ValueError(f"I valori della feature '{feature}' devono essere numerici")
+        values = np.asarray(spec, dtype=float)
+        if not np.all(np.isfinite(values)):
+            raise ValueError(f"I valori della feature '{feature}' devono essere numeri finiti")
+        return values
+
+    raise ValueError(f"Specifica non valida per la feature '{feature}'")
+
+def predict_price_sweep(property_data, grid):
+    """
+    Valuta la variazione di prezzo consigliata su una griglia di scenari what-if
+
+    Il prodotto cartesiano degli assi viene costruito come un'unica matrice
+    e valutato con una sola passata della foresta.
+
+    Args:
+        property_data: Dizionario con i dati base della proprietà
+        grid: Dizionario feature -> lista di valori o {'min', 'max', 'steps'}
+
+    Returns:
+        Assi della griglia e variazioni consigliate come array annidato
+    """
+    if not isinstance(property_data, dict):
+        raise ValueError("I dati della proprietà devono essere un oggetto feature -> valore")
+    if not isinstance(grid, dict):
+        raise ValueError("La griglia dello sweep deve essere un oggetto feature -> valori")
+    if not grid:
+        raise ValueError("La griglia dello sweep non può essere vuota")
+
+    # Carica il modello
+    model_data = load_model()
+    model = model_data['model']
+    scaler = model_data['scaler']
+    features = model_data['features']
+
+    unknown = [feature for feature in grid if feature not in features]
+    if unknown:
+        raise ValueError(f"Feature non supportate nello sweep: {', '.join(unknown)}")
+
+    axis_names = list(grid.keys())
+    axis_values = [_sweep_axis_values(feature, grid[feature]) for feature in axis_names]
+    shape = tuple(len(values) for values in axis_values)
+
+    n_points = math.prod(shape)
+    if n_points > MAX_SWEEP_POINTS:
+        raise ValueError(f"Lo sweep richiede {n_points} punti, il massimo è {MAX_SWEEP_POINTS}")
+
+    # Vettore base nel giusto ordine (feature mancanti a 0 come in predict_price_change)
+    try:
+        base = np.array([float(property_data.get(feature, 0) or 0) for feature in features])
+    except (TypeError, ValueError):
+        raise ValueError("I dati della proprietà devono essere numerici")
+    if not np.all(np.isfinite(base)):
+        raise ValueError("I dati della proprietà devono essere numeri finiti")
+
+    # Replica il vettore base e sovrascrive le colonne degli assi con il prodotto cartesiano
+    matrix = np.tile(base, (n_points, 1))
+    mesh = np.meshgrid(*axis_values, indexing='ij')
+    for feature, values in zip(axis_names, mesh):
+        matrix[:, features.index(feature)] = values.ravel()
+
+    # Standardizza e predice in un'unica passata
+    matrix_scaled = scaler.transform(pd.DataFrame(matrix, columns=features))
+    price_changes = thread_policy.batch_estimator(model, n_points).predict(matrix_scaled).reshape(shape)
+
+    return {
+        'axes': [
+            {'feature': feature, 'values': values.tolist()}
+            for feature, values in zip(axis_names, axis_values)
+        ],
+        'recommended_price_change_percentage': np.round(price_changes, 2).tolist(),
+        'points': n_points,
+        'confidence': 0.85  # Simulazione della confidenza
+    }
+
 if __name__ == "__main__":
     # Test di addestramento e predizione
     model_data = train_model()
@@ -200,4 +549,11 @@ if __name__ == "__main__":
     
     result = predict_price_change(test_property)
     print(f"Variazione di prezzo consigliata: {result['recommended_price_change_percentage']}%")
-    print(f"Confidenza: {result['confidence']}")
\ No newline at end of file
+    print(f"Confidenza: {result['confidence']}")
+    
+    # Test di uno sweep what-if su stagione e domanda
+    sweep = predict_price_sweep(test_property, {
+        'season': [1, 2, 3, 4],
+        'demand_score': {'min': 1, 'max': 10, 'steps': 10}
+    })
+    print(f"Sweep what-if: {sweep['points']} scenari valutati")
\ No newline at end of file
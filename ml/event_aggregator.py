@@ -0,0 +1,358 @@
+"""
+Aggregatore incrementale degli eventi utente
+Consuma uno stream append-only di eventi (login, visualizzazioni, messaggi,
+annunci) e mantiene per ogni utente contatori a finestra mobile in ring buffer
+giornalieri, da cui ricava le feature attese da predict_churn_risk e
+predict_user_cluster senza rileggere lo storico completo
+"""
+
+import os
+import time
+import numpy as np
+import joblib
+
+CHECKPOINT_PATH = os.path.join(os.path.dirname(__file__), 'models/event_aggregator_state.joblib')
+
+SECONDS_PER_DAY = 86400
+
+# Ampiezza della finestra mobile in giorni (un bucket per giorno)
+WINDOW_DAYS = 30
+
+# Canali dei ring buffer: conteggi e somme per bucket giornaliero
+CHANNELS = [
+    'active',            # eventi generati dall'utente (per i giorni attivi)
+    'login',
+    'view',
+    'view_duration',     # somma dei secondi di visualizzazione
+    'search',
+    'message',           # messaggi inviati
+    'message_received',
+    'reply',             # risposte a messaggi ricevuti
+    'response_time',     # somma delle ore di risposta
+    'listing_update',
+    'session',
+    'session_duration'   # somma dei minuti di sessione
+]
+CHANNEL_INDEX = {name: i for i, name in enumerate(CHANNELS)}
+
+# Stato scalare per utente (valori cumulativi o ultimi valori noti)
+SCALARS = [
+    'last_day',
+    'last_login_ts',
+    'registered_ts',
+    'subscription_start_ts',
+    'properties_listed',
+    'listing_completeness_sum',
+    'listing_count',
+    'completed_profile',
+    'subscription_tier'
+]
+SCALAR_INDEX = {name: i for i, name in enumerate(SCALARS)}
+
+# Tipi di evento supportati
+EVENT_TYPES = [
+    'register', 'login', 'view', 'search', 'message', 'message_received',
+    'reply', 'listing', 'listing_removed', 'listing_update', 'session',
+    'profile', 'subscription'
+]
+
+class EventAggregator:
+    """
+    Stato compatto degli utenti basato su array numpy
+
+    Ogni utente occupa una riga di `buckets` (utenti x canali x giorni) e una
+    riga di `scalars`. Il bucket del giorno d è d % WINDOW_DAYS: quando il
+    tempo avanza i bucket usciti dalla finestra vengono azzerati, quindi ogni
+    evento costa O(1).
+    """
+
+    def __init__(self):
+        self.size = 0
+        self.user_ids = []
+        self.id_to_row = {}
+        self.buckets = np.zeros((0, len(CHANNELS), WINDOW_DAYS), dtype=np.float64)
+        self.scalars = np.zeros((0, len(SCALARS)), dtype=np.float64)
+
+    def _row(self, user_id):
+        """
+        Restituisce la riga dell'utente, allocandola se necessario
+        """
+        row = self.id_to_row.get(user_id)
+        if row is not None:
+            return row
+
+        if self.size == self.buckets.shape[0]:
+            capacity = max(64, self.size * 2)
+            buckets = np.zeros((capacity, len(CHANNELS), WINDOW_DAYS), dtype=np.float64)
+            scalars = np.zeros((capacity, len(SCALARS)), dtype=np.float64)
+            buckets[:self.size] = self.buckets[:self.size]
+            scalars[:self.size] = self.scalars[:self.size]
+            self.buckets = buckets
+            self.scalars = scalars
+
+        row = self.size
+        self.size += 1
+        self.user_ids.append(user_id)
+        self.id_to_row[user_id] = row
+        self.scalars[row, SCALAR_INDEX['last_day']] = -1
+        self.scalars[row, SCALAR_INDEX['last_login_ts']] = np.nan
+        self.scalars[row, SCALAR_INDEX['registered_ts']] = np.nan
+        self.scalars[row, SCALAR_INDEX['subscription_start_ts']] = np.nan
+        return row
+
+    def _advance(self, row, day):
+        """
+        Porta la finestra dell'utente al giorno indicato azzerando i bucket scaduti
+        """
+        last_day = int(self.scalars[row, SCALAR_INDEX['last_day']])
+        if day <= last_day:
+            return
+        if last_day < 0 or day - last_day >= WINDOW_DAYS:
+            self.buckets[row] = 0
+        else:
+            self.buckets[row][:, np.arange(last_day + 1, day + 1) % WINDOW_DAYS] = 0
+        self.scalars[row, SCALAR_INDEX['last_day']] = day
+
+    def _add(self, row, channel, day, amount=1.0):
+        self.buckets[row, CHANNEL_INDEX[channel], day % WINDOW_DAYS] += amount
+
+    def consume(self, event):
+        """
+        Aggiorna lo stato con un singolo evento
+
+        Args:
+            event: Dizionario con 'user_id', 'type', 'timestamp' (epoch in secondi)
+                e campi opzionali in base al tipo ('duration_sec', 'duration_min',
+                'response_time_hrs', 'completeness', 'completed_profile',
+                'subscription_tier')
+
+        Returns:
+            True se l'evento è stato applicato, False se troppo vecchio per la finestra
+        """
+        event_type = event['type']
+        if event_type not in EVENT_TYPES:
+            raise ValueError(f"Tipo di evento non supportato: {event_type}")
+
+        ts = float(event.get('timestamp', time.time()))
+        day = int(ts // SECONDS_PER_DAY)
+        row = self._row(event['user_id'])
+        scalars = self.scalars[row]
+
+        # Gli eventi di stato non dipendono dalla finestra
+        if event_type == 'register':
+            scalars[SCALAR_INDEX['registered_ts']] = ts
+        elif event_type == 'listing':
+            scalars[SCALAR_INDEX['properties_listed']] += 1
+            scalars[SCALAR_INDEX['listing_count']] += 1
+            scalars[SCALAR_INDEX['listing_completeness_sum']] += float(event.get('completeness', 0))
+        elif event_type == 'listing_removed':
+            scalars[SCALAR_INDEX['properties_listed']] = max(0, scalars[SCALAR_INDEX['properties_listed']] - 1)
+        elif event_type == 'profile':
+            if 'completed_profile' in event:
+                scalars[SCALAR_INDEX['completed_profile']] = float(event['completed_profile'])
+            if 'subscription_tier' in event:
+                scalars[SCALAR_INDEX['subscription_tier']] = float(event['subscription_tier'])
+        elif event_type == 'subscription':
+            scalars[SCALAR_INDEX['subscription_start_ts']] = ts
+            if 'subscription_tier' in event:
+                scalars[SCALAR_INDEX['subscription_tier']] = float(event['subscription_tier'])
+        elif event_type == 'login':
+            last_login = scalars[SCALAR_INDEX['last_login_ts']]
+            if np.isnan(last_login) or ts > last_login:
+                scalars[SCALAR_INDEX['last_login_ts']] = ts
+
+        if np.isnan(scalars[SCALAR_INDEX['registered_ts']]):
+            scalars[SCALAR_INDEX['registered_ts']] = ts
+
+        # Contatori a finestra mobile
+        self._advance(row, day)
+        last_day = int(scalars[SCALAR_INDEX['last_day']])
+        if day <= last_day - WINDOW_DAYS:
+            return False
+
+        # I messaggi ricevuti non indicano attività dell'utente
+        if event_type != 'message_received':
+            self._add(row, 'active', day)
+
+        if event_type == 'login':
+            self._add(row, 'login', day)
+        elif event_type == 'view':
+            self._add(row, 'view', day)
+            self._add(row, 'view_duration', day, float(event.get('duration_sec', 0)))
+        elif event_type == 'search':
+            self._add(row, 'search', day)
+        elif event_type == 'message':
+            self._add(row, 'message', day)
+        elif event_type == 'message_received':
+            self._add(row, 'message_received', day)
+        elif event_type == 'reply':
+            self._add(row, 'message', day)
+            self._add(row, 'reply', day)
+            self._add(row, 'response_time', day, float(event.get('response_time_hrs', 0)))
+        elif event_type == 'listing_update':
+            self._add(row, 'listing_update', day)
+        elif event_type == 'session':
+            self._add(row, 'session', day)
+            self._add(row, 'session_duration', day, float(event.get('duration_min', 0)))
+
+        return True
+
+    def consume_many(self, events):
+        """
+        Applica una sequenza di eventi nell'ordine dato
+
+        Returns:
+            Numero di eventi applicati
+        """
+        return sum(1 for event in events if self.consume(event))
+
+    def _window(self, user_id, now):
+        """
+        Restituisce riga, bucket aggiornati al giorno corrente e giorno corrente
+        """
+        row = self.id_to_row.get(user_id)
+        if row is None:
+            raise KeyError(user_id)
+        day = int(now // SECONDS_PER_DAY)
+        self._advance(row, day)
+        return row, self.buckets[row], day
+
+    def churn_features(self, user_id, now=None):
+        """
+        Feature per predict_churn_risk calcolate dallo stato corrente
+
+        Args:
+            user_id: ID dell'utente
+            now: Istante di riferimento (epoch in secondi, default ora)
+
+        Returns:
+            Dizionario con le feature del modello di churn
+        """
+        now = time.time() if now is None else now
+        row, buckets, _ = self._window(user_id, now)
+        scalars = self.scalars[row]
+        totals = buckets.sum(axis=1)
+
+        # Senza login l'utente è inattivo dalla registrazione: stessa scala (non
+        # limitata) del login più vecchio, come nei dati di addestramento
+        last_login = scalars[SCALAR_INDEX['last_login_ts']]
+        if np.isnan(last_login):
+            last_login = scalars[SCALAR_INDEX['registered_ts']]
+        days_since_last_login = WINDOW_DAYS if np.isnan(last_login) else max(int((now - last_login) // SECONDS_PER_DAY), 0)
+
+        subscription_start = scalars[SCALAR_INDEX['subscription_start_ts']]
+        subscription_months = 0 if np.isnan(subscription_start) else int((now - subscription_start) // (SECONDS_PER_DAY * 30))
+
+        return {
+            'days_since_last_login': days_since_last_login,
+            'days_active_last_month': int(np.count_nonzero(buckets[CHANNEL_INDEX['active']])),
+            'total_properties_viewed': int(totals[CHANNEL_INDEX['view']]),
+            'messages_sent': int(totals[CHANNEL_INDEX['message']]),
+            'properties_listed': int(scalars[SCALAR_INDEX['properties_listed']]),
+            'subscription_months': subscription_months
+        }
+
+    def cluster_features(self, user_id, now=None):
+        """
+        Feature per predict_user_cluster calcolate dallo stato corrente
+
+        Args:
+            user_id: ID dell'utente
+            now: Istante di riferimento (epoch in secondi, default ora)
+
+        Returns:
+            Dizionario con le feature del modello di clustering
+        """
+        now = time.time() if now is None else now
+        row, buckets, day = self._window(user_id, now)
+        scalars = self.scalars[row]
+        totals = buckets.sum(axis=1)
+
+        def total(channel):
+            return float(totals[CHANNEL_INDEX[channel]])
+
+        def ratio(numerator, denominator):
+            return float(numerator / denominator) if denominator > 0 else 0.0
+
+        last_week = [(day - i) % WINDOW_DAYS for i in range(7)]
+        registered = scalars[SCALAR_INDEX['registered_ts']]
+
+        return {
+            'properties_viewed_monthly': int(total('view')),
+            'avg_view_duration_sec': ratio(total('view_duration'), total('view')),
+            'search_count_monthly': int(total('search')),
+            'msg_sent_monthly': int(total('message')),
+            'msg_response_rate': min(1.0, ratio(total('reply'), total('message_received'))),
+            'avg_response_time_hrs': ratio(total('response_time'), total('reply')),
+            'properties_listed': int(scalars[SCALAR_INDEX['properties_listed']]),
+            'listing_completeness': ratio(scalars[SCALAR_INDEX['listing_completeness_sum']], scalars[SCALAR_INDEX['listing_count']]),
+            'listing_updates_monthly': int(total('listing_update')),
+            'login_frequency_weekly': int(buckets[CHANNEL_INDEX['login'], last_week].sum()),
+            'session_duration_min': ratio(total('session_duration'), total('session')),
+            'completed_profile': float(scalars[SCALAR_INDEX['completed_profile']]),
+            'subscription_tier': int(scalars[SCALAR_INDEX['subscription_tier']]),
+            'days_since_registration': 0 if np.isnan(registered) else int((now - registered) // SECONDS_PER_DAY)
+        }
+
+    def save(self, path=CHECKPOINT_PATH):
+        """
+        Salva un checkpoint dello stato su disco
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        joblib.dump({
+            'window_days': WINDOW_DAYS,
+            'channels': CHANNELS,
+            'scalars_names': SCALARS,
+            'user_ids': list(self.user_ids),
+            'buckets': self.buckets[:self.size].copy(),
+            'scalars': self.scalars[:self.size].copy()
+        }, tmp_path)
+        # Sostituzione atomica per non lasciare checkpoint parziali
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=CHECKPOINT_PATH):
+        """
+        Ripristina lo stato da un checkpoint (aggregatore vuoto se assente)
+        """
+        aggregator = cls()
+        if not os.path.exists(path):
+            return aggregator
+
+        data = joblib.load(path)
+        if data['window_days'] != WINDOW_DAYS or data['channels'] != CHANNELS or data['scalars_names'] != SCALARS:
+            raise ValueError("Checkpoint dell'aggregatore non compatibile con la versione corrente")
+
+        aggregator.size = len(data['user_ids'])
+        aggregator.user_ids = list(data['user_ids'])
+        aggregator.id_to_row = {user_id: row for row, user_id in enumerate(aggregator.user_ids)}
+        aggregator.buckets = data['buckets']
+        aggregator.scalars = data['scalars']
+        return aggregator
+
+if __name__ == "__main__":
+    # Test con uno stream di eventi sintetici
+    import predictive_churn
+    import user_clustering
+
+    now = time.time()
+    aggregator = EventAggregator()
+    aggregator.consume({'user_id': 1, 'type': 'register', 'timestamp': now - 200 * SECONDS_PER_DAY})
+    aggregator.consume({'user_id': 1, 'type': 'subscription', 'timestamp': now - 90 * SECONDS_PER_DAY, 'subscription_tier': 1})
+    aggregator.consume({'user_id': 1, 'type': 'listing', 'timestamp': now - 40 * SECONDS_PER_DAY, 'completeness': 0.9})
+    for i in range(20):
+        ts = now - i * SECONDS_PER_DAY
+        aggregator.consume({'user_id': 1, 'type': 'login', 'timestamp': ts})
+        aggregator.consume({'user_id': 1, 'type': 'view', 'timestamp': ts, 'duration_sec': 90})
+        aggregator.consume({'user_id': 1, 'type': 'session', 'timestamp': ts, 'duration_min': 12})
+
+    aggregator.save()
+    aggregator = EventAggregator.load()
+
+    churn_features = aggregator.churn_features(1, now)
+    cluster_features = aggregator.cluster_features(1, now)
+    print(f"Feature churn: {churn_features}")
+    print(f"Feature clustering: {cluster_features}")
+    print(f"Rischio churn: {predictive_churn.predict_churn_risk(churn_features)['risk_level']}")
+    print(f"Cluster: {user_clustering.predict_user_cluster(cluster_features)['cluster_name']}")
@@ -7,19 +7,43 @@ import os
 import numpy as np
 import pandas as pd
 import xgboost as xgb
-from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import roc_auc_score, accuracy_score
 import joblib
 
+import tuning
+import training_cache
+import thread_policy
+import drift
+
 MODEL_PATH = os.path.join(os.path.dirname(__file__), 'models/churn_model.joblib')
 
-def train_model(data_path=None):
+# Iperparametri predefiniti di XGBoost
+MODEL_PARAMS = {
+    'n_estimators': 100,
+    'learning_rate': 0.1,
+    'max_depth': 4,
+    'random_state': 42,
+    'use_label_encoder': False,
+    'eval_metric': 'logloss'
+}
+
+# Griglia esplorata in modalità tuning
+TUNING_GRID = {
+    'model__n_estimators': [100, 200, 400],
+    'model__learning_rate': [0.03, 0.1, 0.3],
+    'model__max_depth': [3, 4, 6],
+    'model__subsample': [0.8, 1.0]
+}
+
+def train_model(data_path=None, tune=False, warm_start=True):
     """
     Addestra il modello di previsione churn utilizzando dati storici
     
     Args:
         data_path: Percorso del file CSV con i dati storici (opzionale)
+        tune: Se True, cerca gli iperparametri con cross-validation prima dell'addestramento
+        warm_start: Se True, riprende il modello precedente quando i dati sono solo cresciuti
     
     Returns:
         Il modello addestrato
@@ -86,24 +110,47 @@ def train_model(data_path=None):
     X = data.drop('churn', axis=1)
     y = data['churn']
     
-    # Divisione train/test
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-    
-    # Standardizzazione
-    scaler = StandardScaler()
-    X_train_scaled = scaler.fit_transform(X_train)
-    X_test_scaled = scaler.transform(X_test)
-    
-    # Addestramento del modello
-    model = xgb.XGBClassifier(
-        n_estimators=100,
-        learning_rate=0.1,
-        max_depth=4,
-        random_state=42,
-        use_label_encoder=False,
-        eval_metric='logloss'
-    )
-    model.fit(X_train_scaled, y_train)
+    # Dati standardizzati e divisione train/test dalla cache (solo le righe nuove vengono elaborate)
+    training = training_cache.load_training_data('predictive_churn', X, source=data)
+    scaler = training['scaler']
+    X_train_scaled = training['X'][training['train_idx']]
+    X_test_scaled = training['X'][training['test_idx']]
+    X_train = X.iloc[training['train_idx']]
+    y_train = y.values[training['train_idx']]
+    y_test = y.values[training['test_idx']]
+    
+    # Ricerca degli iperparametri (opzionale)
+    model_params = dict(MODEL_PARAMS)
+    tuning_report = None
+    if tune:
+        # XGBoost usa un solo thread per candidato: il parallelismo è nel pool di processi
+        best_params, tuning_report = tuning.tune_hyperparameters(
+            'predictive_churn',
+            [('scaler', StandardScaler()), ('model', xgb.XGBClassifier(n_jobs=1, **MODEL_PARAMS))],
+            TUNING_GRID,
+            X_train,
+            y_train,
+            scoring='roc_auc'
+        )
+        model_params.update(best_params['model'])
+    
+    # Ripresa del modello precedente: boosting continuato in proporzione alle righe aggiunte
+    previous = training_cache.previous_artifact(MODEL_PATH, training) if warm_start and not tune else None
+    if previous is not None:
+        model = previous['model']
+        info = previous['training_cache']
+        extra = training_cache.extra_estimators(info['base_estimators'], training['n_rows'] - info['n_rows'], info['n_rows'])
+        if extra:
+            print(f"Churn Model: warm start con {extra} round di boosting aggiuntivi")
+            booster = model.get_booster()
+            model = xgb.XGBClassifier(**{**model.get_params(), 'n_estimators': extra})
+            model.fit(X_train_scaled, y_train, xgb_model=booster)
+        cache_info = training_cache.artifact_info(training, 'warm' if extra else 'unchanged', info['base_estimators'])
+    else:
+        # Addestramento del modello da zero
+        model = xgb.XGBClassifier(**model_params)
+        model.fit(X_train_scaled, y_train)
+        cache_info = training_cache.artifact_info(training, 'cold', model_params['n_estimators'])
     
     # Valutazione
     y_pred_proba = model.predict_proba(X_test_scaled)[:, 1]
@@ -117,9 +164,16 @@ def train_model(data_path=None):
     model_data = {
         'model': model,
         'scaler': scaler,
-        'features': list(X.columns)
+        'features': list(X.columns),
+        'drift_reference': drift.build_reference(X_train),
+        'training_cache': cache_info
     }
     
+    if tuning_report is not None:
+        tuning_report['test_auc'] = float(auc)
+        tuning.save_report('predictive_churn', tuning_report)
+        model_data['tuning'] = tuning_report
+    
     os.makedirs(os.path.dirname(MODEL_PATH), exist_ok=True)
     joblib.dump(model_data, MODEL_PATH)
     
@@ -134,49 +188,26 @@ def load_model():
     """
     # Se il modello non esiste, addestralo
     if not os.path.exists(MODEL_PATH):
-        return train_model()
+        model_data = train_model()
+    else:
+        # Carica il modello esistente
+        model_data = joblib.load(MODEL_PATH)
+    
+    # Allinea i thread del modello al budget del processo
+    thread_policy.apply_to_estimator(model_data['model'])
     
-    # Carica il modello esistente
-    return joblib.load(MODEL_PATH)
+    return model_data
 
-def predict_churn_risk(user_data):
+def _risk_factors(user_data):
     """
-    Predice il rischio di abbandono per un utente
+    Individua i fattori di rischio di abbandono dai dati grezzi dell'utente
     
     Args:
         user_data: Dizionario con i dati di engagement dell'utente
     
     Returns:
-        Probabilità di churn e fattori di rischio
+        Lista dei fattori di rischio
     """
-    # Carica il modello
-    model_data = load_model()
-    model = model_data['model']
-    scaler = model_data['scaler']
-    features = model_data['features']
-    
-    # Crea DataFrame dall'utente
-    user_df = pd.DataFrame([user_data])
-    
-    # Calcola eventuali variabili derivate mancanti
-    if 'avg_daily_activity' not in user_df.columns and 'total_properties_viewed' in user_df.columns and 'days_active_last_month' in user_df.columns:
-        user_df['avg_daily_activity'] = user_df['total_properties_viewed'] / np.maximum(1, user_df['days_active_last_month'])
-    
-    # Assicurati che tutte le feature necessarie siano presenti
-    for feature in features:
-        if feature not in user_df.columns:
-            user_df[feature] = 0
-    
-    # Seleziona le feature nel giusto ordine
-    user_df = user_df[features]
-    
-    # Standardizza
-    user_scaled = scaler.transform(user_df)
-    
-    # Predizione
-    churn_probability = model.predict_proba(user_scaled)[0, 1]
-    
-    # Identificazione dei fattori di rischio
     risk_factors = []
     
     if user_data.get('days_since_last_login', 0) > 14:
@@ -214,6 +245,51 @@ def predict_churn_risk(user_data):
             'importance': 'bassa'
         })
     
+    return risk_factors
+
+def predict_churn_risk(user_data):
+    """
+    Predice il rischio di abbandono per un utente
+    
+    Args:
+        user_data: Dizionario con i dati di engagement dell'utente
+    
+    Returns:
+        Probabilità di churn e fattori di rischio
+    """
+    # Carica il modello
+    model_data = load_model()
+    model = model_data['model']
+    scaler = model_data['scaler']
+    features = model_data['features']
+    
+    # Crea DataFrame dall'utente
+    user_df = pd.DataFrame([user_data])
+    
+    # Calcola eventuali variabili derivate mancanti
+    if 'avg_daily_activity' not in user_df.columns and 'total_properties_viewed' in user_df.columns and 'days_active_last_month' in user_df.columns:
+        user_df['avg_daily_activity'] = user_df['total_properties_viewed'] / np.maximum(1, user_df['days_active_last_month'])
+    
+    # Assicurati che tutte le feature necessarie siano presenti
+    for feature in features:
+        if feature not in user_df.columns:
+            user_df[feature] = 0
+    
+    # Seleziona le feature nel giusto ordine
+    user_df = user_df[features]
+    
+    # Aggiorna gli istogrammi di deriva degli input
+    drift.observe('predictive_churn', model_data, user_df.values)
+    
+    # Standardizza
+    user_scaled = scaler.transform(user_df)
+    
+    # Predizione
+    churn_probability = model.predict_proba(user_scaled)[0, 1]
+    
+    # Identificazione dei fattori di rischio
+    risk_factors = _risk_factors(user_data)
+    
     # Determinare il livello di rischio
     risk_level = 'basso'
     if churn_probability > 0.7:
@@ -227,6 +303,75 @@ def predict_churn_risk(user_data):
         'risk_factors': risk_factors
     }
 
+def predict_churn_probabilities(users_df, model_data=None):
+    """
+    Predice la probabilità di churn e il livello di rischio per più utenti
+    
+    Args:
+        users_df: DataFrame con una riga per utente
+        model_data: Modello già caricato (opzionale, altrimenti viene caricato)
+    
+    Returns:
+        Array delle probabilità (arrotondate a 2 decimali) e array dei livelli di rischio
+    """
+    if model_data is None:
+        model_data = load_model()
+    features = model_data['features']
+    
+    # Calcola la variabile derivata se mancante
+    if 'avg_daily_activity' not in users_df.columns and 'total_properties_viewed' in users_df.columns and 'days_active_last_month' in users_df.columns:
+        users_df = users_df.assign(
+            avg_daily_activity=users_df['total_properties_viewed'] / np.maximum(1, users_df['days_active_last_month'])
+        )
+    
+    # Seleziona le feature nel giusto ordine (mancanti a 0)
+    users_df = users_df.reindex(columns=features).fillna(0)
+    
+    # Standardizza e predice
+    users_scaled = model_data['scaler'].transform(users_df)
+    churn_probability = model_data['model'].predict_proba(users_scaled)[:, 1]
+    
+    # Stesse soglie di predict_churn_risk
+    risk_level = np.select(
+        [churn_probability > 0.7, churn_probability > 0.4],
+        ['alto', 'medio'],
+        default='basso'
+    )
+    
+    return np.round(churn_probability.astype(np.float64), 2), risk_level
+
+def predict_churn_risk_batch(users_data):
+    """
+    Predice il rischio di abbandono per più utenti con una sola predizione
+    
+    Args:
+        users_data: Lista di dizionari con i dati di engagement degli utenti
+    
+    Returns:
+        Lista di risultati nello stesso formato di predict_churn_risk
+    """
+    model_data = load_model()
+    users_df = pd.DataFrame(users_data)
+    
+    # Calcola eventuali variabili derivate mancanti
+    if 'avg_daily_activity' not in users_df.columns and 'total_properties_viewed' in users_df.columns and 'days_active_last_month' in users_df.columns:
+        users_df['avg_daily_activity'] = users_df['total_properties_viewed'] / np.maximum(1, users_df['days_active_last_month'])
+    users_df = users_df.reindex(columns=model_data['features']).fillna(0)
+    
+    # Aggiorna gli istogrammi di deriva degli input
+    drift.observe('predictive_churn', model_data, users_df.values)
+    
+    churn_probability, risk_level = predict_churn_probabilities(users_df, model_data)
+    
+    return [
+        {
+            'churn_probability': float(probability),
+            'risk_level': str(level),
+            'risk_factors': _risk_factors(user_data)
+        }
+        for user_data, probability, level in zip(users_data, churn_probability, risk_level)
+    ]
+
 if __name__ == "__main__":
     # Test di addestramento e predizione
     model_data = train_model()
@@ -0,0 +1,265 @@
+"""
+Profiler a campionamento attivabile a runtime per l'API ML
+Per una durata limitata campiona gli stack Python di una frazione delle
+richieste, ripartisce il tempo tra pandas/scikit-learn/xgboost/codice ML e
+produce un file collapsed-stack compatibile con i flame graph.
+Quando nessuna sessione è attiva gli hook si limitano a un controllo su None.
+"""
+
+import os
+import sys
+import hmac
+import time
+import random
+import threading
+from collections import Counter, deque
+from flask import g, request
+
+PROFILES_DIR = os.path.join(os.path.dirname(__file__), 'models/profiles')
+
+# Token richiesto per controllare il profiler (endpoint disabilitati se assente)
+ADMIN_TOKEN = os.environ.get('ML_ADMIN_TOKEN', '')
+ADMIN_TOKEN_HEADER = 'X-Admin-Token'
+
+# Limiti delle sessioni
+MAX_DURATION_S = 300
+MIN_INTERVAL_MS = 1
+DEFAULT_INTERVAL_MS = 5
+
+# Profili per richiesta conservati per sessione
+MAX_REQUEST_PROFILES = 200
+
+ML_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Categorie di tempo, riconosciute dal percorso del file del frame più interno
+CATEGORIES = [
+    ('pandas', os.sep + 'pandas' + os.sep),
+    ('sklearn', os.sep + 'sklearn' + os.sep),
+    ('xgboost', os.sep + 'xgboost' + os.sep),
+    ('numpy', os.sep + 'numpy' + os.sep),
+    ('joblib', os.sep + 'joblib' + os.sep),
+    ('framework', os.sep + 'werkzeug' + os.sep),
+    ('framework', os.sep + 'flask' + os.sep)
+]
+
+# Sessione corrente (None = profiler disattivato)
+_session = None
+_last_session = None
+_session_lock = threading.Lock()
+
+def _category(filename):
+    for category, marker in CATEGORIES:
+        if marker in filename:
+            return category
+    if filename.startswith(ML_DIR):
+        return 'ml'
+    return 'other'
+
+def _collapse(frame):
+    """
+    Converte uno stack in formato collapsed (dal frame più esterno al più interno)
+    """
+    labels = []
+    while frame is not None:
+        code = frame.f_code
+        labels.append(f"{frame.f_globals.get('__name__', '?')}:{code.co_name}")
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+class ProfilingSession:
+    """
+    Sessione di campionamento con scadenza
+    """
+
+    def __init__(self, sample_rate, duration_s, interval_ms):
+        self.sample_rate = sample_rate
+        self.interval_s = interval_ms / 1000.0
+        self.started_at = time.time()
+        self.deadline = time.monotonic() + duration_s
+        self.stacks = Counter()
+        self.categories = Counter()
+        self.requests = deque(maxlen=MAX_REQUEST_PROFILES)
+        self.sampled_requests = 0
+        self.output_path = None
+        self._tracked = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='ml-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def track(self, thread_id, record):
+        with self._lock:
+            self._tracked[thread_id] = record
+            self.sampled_requests += 1
+
+    def untrack(self, thread_id):
+        with self._lock:
+            record = self._tracked.pop(thread_id, None)
+            if record is not None:
+                self.requests.append(record)
+
+    def _sample(self):
+        frames = sys._current_frames()
+        with self._lock:
+            for thread_id, record in self._tracked.items():
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                category = _category(frame.f_code.co_filename)
+                self.stacks[_collapse(frame)] += 1
+                self.categories[category] += 1
+                record['samples'] += 1
+                record['categories'][category] += 1
+
+    def _run(self):
+        while not self._stopped.is_set() and time.monotonic() < self.deadline:
+            self._sample()
+            self._stopped.wait(self.interval_s)
+        _finish(self)
+
+    def stop(self):
+        self._stopped.set()
+
+    def collapsed(self):
+        """
+        Stack aggregati in formato collapsed ("frame;frame;frame conteggio")
+        """
+        with self._lock:
+            return '\n'.join(f'{stack} {count}' for stack, count in self.stacks.most_common()) + '\n'
+
+    def summary(self):
+        with self._lock:
+            total = sum(self.categories.values())
+            return {
+                'active': not self._stopped.is_set() and time.monotonic() < self.deadline,
+                'started_at': self.started_at,
+                'remaining_s': round(max(0.0, self.deadline - time.monotonic()), 1),
+                'sample_rate': self.sample_rate,
+                'interval_ms': self.interval_s * 1000,
+                'sampled_requests': self.sampled_requests,
+                'samples': total,
+                'time_split': {
+                    category: round(count / total, 4) for category, count in self.categories.most_common()
+                } if total else {},
+                'requests': [
+                    {**record, 'categories': dict(record['categories'])} for record in self.requests
+                ],
+                'output_path': self.output_path
+            }
+
+def _finish(session):
+    """
+    Disattiva la sessione e salva il file collapsed-stack
+    """
+    global _session, _last_session
+
+    with _session_lock:
+        if _session is session:
+            _session = None
+        _last_session = session
+
+    session._stopped.set()
+    if session.stacks:
+        os.makedirs(PROFILES_DIR, exist_ok=True)
+        path = os.path.join(PROFILES_DIR, f'profile_{os.getpid()}_{int(session.started_at)}.collapsed')
+        with open(path, 'w') as f:
+            f.write(session.collapsed())
+        session.output_path = path
+        print(f"Profilo salvato in {path}")
+
+def authorized():
+    """
+    Verifica il token di amministrazione della richiesta corrente
+    """
+    if not ADMIN_TOKEN:
+        return False
+    return hmac.compare_digest(request.headers.get(ADMIN_TOKEN_HEADER, ''), ADMIN_TOKEN)
+
+def start(sample_rate=0.1, duration_s=30, interval_ms=DEFAULT_INTERVAL_MS):
+    """
+    Avvia una sessione di profiling
+
+    Args:
+        sample_rate: Frazione delle richieste da campionare (0-1)
+        duration_s: Durata della sessione in secondi (max MAX_DURATION_S)
+        interval_ms: Intervallo di campionamento degli stack
+
+    Returns:
+        Riepilogo della sessione avviata
+    """
+    global _session
+
+    sample_rate = float(sample_rate)
+    duration_s = float(duration_s)
+    interval_ms = float(interval_ms)
+    if not 0 < sample_rate <= 1:
+        raise ValueError('sample_rate deve essere compreso tra 0 e 1')
+    if not 0 < duration_s <= MAX_DURATION_S:
+        raise ValueError(f'duration_s deve essere compreso tra 0 e {MAX_DURATION_S}')
+    if interval_ms < MIN_INTERVAL_MS:
+        raise ValueError(f'interval_ms deve essere almeno {MIN_INTERVAL_MS}')
+
+    with _session_lock:
+        if _session is not None:
+            raise ValueError('Una sessione di profiling è già attiva')
+        _session = ProfilingSession(sample_rate, duration_s, interval_ms)
+        session = _session
+
+    session.start()
+    return session.summary()
+
+def stop():
+    """
+    Interrompe la sessione attiva (se presente)
+    """
+    session = _session
+    if session is not None:
+        session.stop()
+        session._thread.join()
+    return status()
+
+def status():
+    """
+    Riepilogo della sessione attiva o dell'ultima conclusa
+    """
+    session = _session or _last_session
+    if session is None:
+        return {'active': False}
+    return session.summary()
+
+def collapsed():
+    """
+    Stack collapsed della sessione attiva o dell'ultima conclusa
+    """
+    session = _session or _last_session
+    return session.collapsed() if session is not None else ''
+
+def init_app(app):
+    """
+    Registra gli hook di richiesta sull'app Flask
+    """
+    @app.before_request
+    def _profile_request_start():
+        session = _session
+        if session is None or random.random() >= session.sample_rate:
+            return
+        g.ml_profile_session = session
+        g.ml_profile_start = time.perf_counter()
+        session.track(threading.get_ident(), {
+            'path': request.path,
+            'samples': 0,
+            'categories': Counter()
+        })
+
+    @app.teardown_request
+    def _profile_request_end(exc):
+        session = g.pop('ml_profile_session', None)
+        if session is None:
+            return
+        with session._lock:
+            record = session._tracked.get(threading.get_ident())
+            if record is not None:
+                record['duration_ms'] = round((time.perf_counter() - g.pop('ml_profile_start')) * 1000, 3)
+        session.untrack(threading.get_ident())
@@ -0,0 +1,390 @@
+"""
+Indice di similarità tra utenti basato sullo spazio PCA del clustering
+Conserva il vettore PCA di ogni utente e restituisce i vicini più prossimi.
+Insieme ai vettori salva le feature originali, così dopo un riaddestramento
+da zero del clustering (nuova PCA) l'indice viene riproiettato invece di
+essere svuotato
+"""
+
+import os
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+import joblib
+
+import user_clustering
+
+INDEX_PATH = os.path.join(os.path.dirname(__file__), 'models/similar_users_index.joblib')
+
+# Sotto questa soglia la ricerca è esatta (forza bruta), sopra usa le celle k-means (IVF)
+BRUTE_FORCE_THRESHOLD = 5000
+
+# Numero di celle k-means esplorate per ogni ricerca in modalità IVF
+N_PROBE = 2
+
+# Numero predefinito e massimo di vicini restituiti
+DEFAULT_K = 10
+MAX_K = 100
+
+# Utenti riproiettati per blocco dopo un cambio dello spazio PCA
+REEMBED_CHUNK = 50000
+
+# Indice caricato in memoria (condiviso tra le richieste) e lock che ne
+# serializza caricamento, inserimenti, riallineamenti e ricerche
+_index = None
+_index_lock = threading.RLock()
+
+def _embedding_signature(model_data):
+    """
+    Calcola un'impronta dello spazio di embedding (standardizzazione + PCA)
+
+    I centroidi k-means non fanno parte dell'impronta: un riaddestramento
+    warm li sposta ma lascia invariati i vettori, quindi basta riassegnare
+    le celle (vedi SimilarUsersIndex.recell).
+
+    Args:
+        model_data: Modello di clustering caricato
+
+    Returns:
+        Stringa esadecimale che identifica lo spazio PCA corrente
+    """
+    digest = hashlib.sha1()
+    digest.update(np.ascontiguousarray(model_data['scaler'].mean_).tobytes())
+    digest.update(np.ascontiguousarray(model_data['scaler'].scale_).tobytes())
+    digest.update(np.ascontiguousarray(model_data['pca'].components_).tobytes())
+    digest.update(np.ascontiguousarray(model_data['pca'].mean_).tobytes())
+    return digest.hexdigest()
+
+class SimilarUsersIndex:
+    """
+    Indice dei vicini più prossimi sui vettori PCA degli utenti
+
+    I vettori sono salvati in array contigui a capacità crescente; ogni riga
+    è associata alla cella k-means dell'utente, usata come lista invertita
+    quando l'indice supera BRUTE_FORCE_THRESHOLD, e alle feature originali
+    dell'utente, usate per riproiettarlo in un nuovo spazio PCA.
+    """
+
+    def __init__(self, centroids, signature, dim, features):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.signature = signature
+        self.features = list(features)
+        self.size = 0
+        self.user_ids = []
+        self.id_to_row = {}
+        self.vectors = np.empty((0, dim), dtype=np.float32)
+        self.cells = np.empty(0, dtype=np.int32)
+        self.raw = np.empty((0, len(self.features)), dtype=np.float64)
+
+    def _reserve(self, n_new):
+        """
+        Garantisce spazio per n_new nuove righe raddoppiando la capacità
+        """
+        needed = self.size + n_new
+        capacity = self.vectors.shape[0]
+        if needed <= capacity:
+            return
+        new_capacity = max(needed, capacity * 2, 64)
+        vectors = np.empty((new_capacity, self.vectors.shape[1]), dtype=np.float32)
+        cells = np.empty(new_capacity, dtype=np.int32)
+        raw = np.empty((new_capacity, self.raw.shape[1]), dtype=np.float64)
+        vectors[:self.size] = self.vectors[:self.size]
+        cells[:self.size] = self.cells[:self.size]
+        raw[:self.size] = self.raw[:self.size]
+        self.vectors = vectors
+        self.cells = cells
+        self.raw = raw
+
+    def add(self, user_ids, vectors, cells, raw):
+        """
+        Inserisce o aggiorna gli utenti nell'indice
+
+        Args:
+            user_ids: Lista di ID utente
+            vectors: Array (n, dim) con i vettori PCA
+            cells: Array (n,) con il cluster k-means di ciascun utente
+            raw: Array (n, feature) con le feature originali, nell'ordine di self.features
+
+        Returns:
+            Numero di utenti inseriti per la prima volta
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        cells = np.asarray(cells, dtype=np.int32)
+        raw = np.asarray(raw, dtype=np.float64)
+        self._reserve(len(user_ids))
+
+        inserted = 0
+        for user_id, vector, cell, values in zip(user_ids, vectors, cells, raw):
+            row = self.id_to_row.get(user_id)
+            if row is None:
+                row = self.size
+                self.id_to_row[user_id] = row
+                self.user_ids.append(user_id)
+                self.size += 1
+                inserted += 1
+            self.vectors[row] = vector
+            self.cells[row] = cell
+            self.raw[row] = values
+
+        return inserted
+
+    def recell(self, centroids):
+        """
+        Adotta nuovi centroidi e riassegna ogni vettore alla cella più vicina
+
+        Args:
+            centroids: Centroidi k-means nello stesso spazio PCA
+        """
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        vectors = self.vectors[:self.size]
+        # ||v - c||² = ||v||² - 2 v·c + ||c||² (||v||² è costante per riga)
+        distances = (self.centroids ** 2).sum(axis=1) - 2 * vectors @ self.centroids.T
+        self.cells[:self.size] = np.argmin(distances, axis=1)
+
+    def search(self, user_id, k=DEFAULT_K):
+        """
+        Restituisce i k utenti più vicini a user_id (escluso l'utente stesso)
+
+        Args:
+            user_id: ID dell'utente di riferimento
+            k: Numero di vicini da restituire
+
+        Returns:
+            Lista di tuple (user_id, distanza, cluster_id) ordinate per distanza
+        """
+        row = self.id_to_row.get(user_id)
+        if row is None:
+            raise KeyError(user_id)
+
+        query = self.vectors[row]
+        vectors = self.vectors[:self.size]
+
+        if self.size <= BRUTE_FORCE_THRESHOLD:
+            # Ricerca esatta su tutti gli utenti
+            candidates = np.arange(self.size)
+        else:
+            # Ricerca IVF: solo le celle con i centroidi più vicini alla query
+            centroid_distances = ((self.centroids - query) ** 2).sum(axis=1)
+            probe = np.argsort(centroid_distances)[:N_PROBE]
+            candidates = np.flatnonzero(np.isin(self.cells[:self.size], probe))
+
+        candidates = candidates[candidates != row]
+        if len(candidates) == 0:
+            return []
+
+        distances = ((vectors[candidates] - query) ** 2).sum(axis=1)
+        k = min(k, len(candidates))
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top])]
+
+        return [
+            (self.user_ids[candidates[i]], float(np.sqrt(distances[i])), int(self.cells[candidates[i]]))
+            for i in top
+        ]
+
+    def to_dict(self):
+        """
+        Serializza l'indice in un dizionario salvabile con joblib
+        """
+        return {
+            'centroids': self.centroids,
+            'signature': self.signature,
+            'features': list(self.features),
+            'user_ids': list(self.user_ids),
+            'vectors': self.vectors[:self.size].copy(),
+            'cells': self.cells[:self.size].copy(),
+            'raw': self.raw[:self.size].copy()
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Ricostruisce l'indice da un dizionario salvato
+        """
+        index = cls(data['centroids'], data['signature'], data['vectors'].shape[1], data['features'])
+        index.add(data['user_ids'], data['vectors'], data['cells'], data['raw'])
+        return index
+
+def _new_index(model_data):
+    return SimilarUsersIndex(
+        model_data['kmeans'].cluster_centers_,
+        _embedding_signature(model_data),
+        model_data['pca'].n_components_,
+        model_data['features']
+    )
+
+def _reembed(index, model_data):
+    """
+    Riproietta tutti gli utenti di un indice nello spazio PCA del modello corrente
+
+    Args:
+        index: Indice costruito con un modello di clustering precedente
+        model_data: Modello di clustering corrente
+
+    Returns:
+        Nuovo SimilarUsersIndex con gli stessi utenti
+    """
+    rebuilt = _new_index(model_data)
+    for start in range(0, index.size, REEMBED_CHUNK):
+        end = min(start + REEMBED_CHUNK, index.size)
+        users_df = pd.DataFrame(index.raw[start:end], columns=index.features)
+        vectors, cells = user_clustering.embed_users(users_df, model_data)
+        rebuilt.add(index.user_ids[start:end], vectors, cells, users_df.reindex(columns=rebuilt.features).fillna(0).values)
+    return rebuilt
+
+def _align(index, model_data):
+    """
+    Allinea l'indice al modello corrente: riproietta gli utenti se la PCA è
+    cambiata, altrimenti riassegna solo le celle se i centroidi si sono spostati
+
+    Returns:
+        Tupla (indice allineato, 'reembedded' | 'recelled' | None se già allineato)
+    """
+    if index.signature != _embedding_signature(model_data):
+        return _reembed(index, model_data), 'reembedded'
+    if not np.array_equal(index.centroids, np.asarray(model_data['kmeans'].cluster_centers_, dtype=np.float32)):
+        index.recell(model_data['kmeans'].cluster_centers_)
+        return index, 'recelled'
+    return index, None
+
+def save_index(index):
+    """
+    Salva l'indice su disco con sostituzione atomica
+    """
+    os.makedirs(os.path.dirname(INDEX_PATH), exist_ok=True)
+    tmp_path = f'{INDEX_PATH}.{os.getpid()}.tmp'
+    joblib.dump(index.to_dict(), tmp_path)
+    os.replace(tmp_path, INDEX_PATH)
+
+def load_index():
+    """
+    Carica l'indice dei vicini (vuoto se assente), allineato al modello di clustering corrente
+
+    Returns:
+        L'indice SimilarUsersIndex corrente
+    """
+    global _index
+
+    with _index_lock:
+        if _index is not None:
+            return _index
+
+        model_data = user_clustering.load_model()
+
+        if os.path.exists(INDEX_PATH):
+            index, change = _align(SimilarUsersIndex.from_dict(joblib.load(INDEX_PATH)), model_data)
+            if change == 'reembedded':
+                print(f"Indice utenti simili riproiettato nel nuovo spazio PCA ({index.size} utenti)")
+                save_index(index)
+            _index = index
+        else:
+            _index = _new_index(model_data)
+        return _index
+
+def refresh_index():
+    """
+    Riallinea l'indice al clustering appena riaddestrato senza perdere utenti:
+    dopo un warm start (stessa PCA) riassegna solo le celle, dopo un
+    addestramento da zero riproietta gli utenti dalle feature salvate
+
+    Returns:
+        Dizionario con l'operazione eseguita e la dimensione dell'indice
+    """
+    global _index
+
+    with _index_lock:
+        if _index is None and not os.path.exists(INDEX_PATH):
+            return {'action': None, 'index_size': 0}
+
+        index = _index if _index is not None else SimilarUsersIndex.from_dict(joblib.load(INDEX_PATH))
+        index, change = _align(index, user_clustering.load_model())
+        if change is not None:
+            save_index(index)
+        _index = index
+        return {'action': change, 'index_size': index.size}
+
+def add_users(users_data):
+    """
+    Inserisce (o aggiorna) una lista di utenti nell'indice e lo salva su disco
+
+    Nota: ogni inserimento riscrive l'intero file dell'indice (costo O(N) in I/O)
+    e ogni processo mantiene la propria copia in memoria: all'interno di un
+    processo gli inserimenti sono serializzati, ma con più worker gli
+    inserimenti vanno indirizzati a un solo processo, altrimenti i salvataggi
+    si sovrascrivono a vicenda e gli altri worker non vedono i nuovi utenti
+    fino al riavvio.
+
+    Args:
+        users_data: Lista di dizionari con 'user_id' e le feature del clustering
+
+    Returns:
+        Numero di utenti inseriti e dimensione totale dell'indice
+    """
+    if not users_data:
+        raise ValueError("Nessun utente da indicizzare")
+
+    user_ids = []
+    for user in users_data:
+        if user.get('user_id') is None:
+            raise ValueError("Ogni utente deve avere un 'user_id'")
+        user_ids.append(user['user_id'])
+
+    with _index_lock:
+        index = load_index()
+        users_df = pd.DataFrame(users_data).reindex(columns=index.features).fillna(0)
+        vectors, cells = user_clustering.embed_users(users_df)
+        inserted = index.add(user_ids, vectors, cells, users_df.values)
+        save_index(index)
+
+        return {
+            'inserted': inserted,
+            'updated': len(user_ids) - inserted,
+            'index_size': index.size
+        }
+
+def find_similar_users(user_id, k=DEFAULT_K):
+    """
+    Trova gli utenti più simili a un utente già indicizzato
+
+    Args:
+        user_id: ID dell'utente
+        k: Numero di vicini da restituire
+
+    Returns:
+        Lista dei vicini con distanza nello spazio PCA e cluster
+    """
+    try:
+        k = int(k)
+    except (TypeError, ValueError):
+        raise ValueError("k deve essere un numero intero")
+    if not 1 <= k <= MAX_K:
+        raise ValueError(f"k deve essere compreso tra 1 e {MAX_K}")
+
+    with _index_lock:
+        index = load_index()
+        neighbours = index.search(user_id, k)
+        method = 'exact' if index.size <= BRUTE_FORCE_THRESHOLD else 'ivf'
+
+    return {
+        'user_id': user_id,
+        'method': method,
+        'neighbours': [
+            {'user_id': neighbour_id, 'distance': round(distance, 4), 'cluster_id': cluster_id}
+            for neighbour_id, distance, cluster_id in neighbours
+        ]
+    }
+
+if __name__ == "__main__":
+    # Test di indicizzazione e ricerca con utenti sintetici
+    np.random.seed(0)
+    model_data = user_clustering.load_model()
+    test_users = []
+    for i in range(200):
+        user = {feature: float(abs(np.random.normal(5, 3))) for feature in model_data['features']}
+        user['user_id'] = i
+        test_users.append(user)
+
+    print(add_users(test_users))
+    result = find_similar_users(0, k=5)
+    print(f"Utenti simili a 0 ({result['method']}): {[n['user_id'] for n in result['neighbours']]}")
@@ -16,6 +16,11 @@ def start_ml_service():
     # Cambia la directory corrente nella directory dello script
     os.chdir(os.path.dirname(os.path.abspath(__file__)))
     
+    # Imposta il budget di thread prima di caricare le librerie native
+    import thread_policy
+    policy = thread_policy.configure()
+    print(f"Politica di threading: {policy['threads_per_worker']} thread per worker, affinità CPU: {policy['cpu_affinity'] or 'nessuna'}")
+    
     # Verifica che i modelli siano pronti
     print("Inizializzazione modelli...")
     
@@ -0,0 +1,207 @@
+"""
+Politica di threading del servizio ML
+Imposta un budget di thread per processo per BLAS, OpenMP e joblib,
+così più worker dell'API non si contendono gli stessi core
+
+Va configurata prima di importare numpy, scikit-learn e xgboost.
+"""
+
+import os
+import copy
+
+# Variabili d'ambiente lette dai pool nativi al primo caricamento
+THREAD_ENV_VARS = [
+    'OMP_NUM_THREADS',
+    'OPENBLAS_NUM_THREADS',
+    'MKL_NUM_THREADS',
+    'BLIS_NUM_THREADS',
+    'VECLIB_MAXIMUM_THREADS',
+    'NUMEXPR_NUM_THREADS'
+]
+
+# Righe minime perché la predizione parallela di un estimatore convenga:
+# sotto questa soglia il dispatch sul pool di joblib costa più della predizione
+PARALLEL_MIN_ROWS = 256
+
+# Cartella dei lock con cui i worker si assegnano un indice per il pinning automatico
+WORKER_LOCK_DIR = os.path.join(os.path.dirname(__file__), 'models/workers')
+
+# Configurazione effettiva del processo (valorizzata da configure)
+_policy = None
+
+# File di lock dell'indice del worker (resta aperto per tutta la vita del processo)
+_worker_lock = None
+
+def _available_cpus():
+    """
+    Restituisce i core utilizzabili dal processo
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def _parse_cpu_list(value):
+    """
+    Converte una lista di core in formato '0-3,6' in una lista di interi
+    """
+    cpus = []
+    for part in value.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-', 1)
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+def _claim_worker_index(workers):
+    """
+    Assegna al processo il primo indice di worker libero tramite lock esclusivi
+
+    Il lock viene rilasciato dal sistema operativo alla terminazione del processo,
+    quindi un worker riavviato riprende l'indice lasciato libero.
+    """
+    global _worker_lock
+    import fcntl
+
+    os.makedirs(WORKER_LOCK_DIR, exist_ok=True)
+    for index in range(workers):
+        fd = os.open(os.path.join(WORKER_LOCK_DIR, f'worker_{index}.lock'), os.O_CREAT | os.O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            continue
+        _worker_lock = fd
+        return index
+
+    raise RuntimeError(
+        f"Nessun indice di worker libero su {workers}: impostare ML_WORKER_INDEX "
+        "o verificare ML_WORKERS"
+    )
+
+def configure():
+    """
+    Calcola e applica il budget di thread del processo
+
+    Variabili d'ambiente:
+        ML_WORKERS: Numero di worker dell'API sulla stessa macchina (default 1)
+        ML_WORKER_INDEX: Indice di questo worker, usato per il pinning automatico
+            (se assente viene assegnato il primo indice libero tra i worker attivi)
+        ML_THREADS_PER_WORKER: Budget esplicito di thread (default core / worker)
+        ML_CPU_AFFINITY: 'auto' per assegnare a ogni worker un blocco di core,
+            oppure una lista esplicita come '0-3,6'
+
+    Returns:
+        Dizionario con la configurazione applicata
+    """
+    global _policy
+
+    if _policy is not None:
+        return _policy
+
+    cpus = _available_cpus()
+    workers = max(1, int(os.environ.get('ML_WORKERS', 1)))
+    worker_index = int(os.environ.get('ML_WORKER_INDEX', 0)) % workers
+    threads = int(os.environ.get('ML_THREADS_PER_WORKER', 0)) or max(1, len(cpus) // workers)
+
+    # Pinning opzionale del worker su un sottoinsieme di core
+    affinity = None
+    affinity_spec = os.environ.get('ML_CPU_AFFINITY', '').strip()
+    if affinity_spec and hasattr(os, 'sched_setaffinity'):
+        if affinity_spec == 'auto':
+            # Senza indice esplicito ogni worker si prenota un blocco di core diverso
+            if workers > 1 and 'ML_WORKER_INDEX' not in os.environ:
+                worker_index = _claim_worker_index(workers)
+            start = (worker_index * threads) % len(cpus)
+            affinity = [cpus[(start + i) % len(cpus)] for i in range(min(threads, len(cpus)))]
+        else:
+            affinity = _parse_cpu_list(affinity_spec)
+        os.sched_setaffinity(0, affinity)
+        threads = min(threads, len(affinity))
+
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(threads)
+
+    _policy = {
+        'workers': workers,
+        'worker_index': worker_index,
+        'threads_per_worker': threads,
+        'cpu_affinity': affinity
+    }
+
+    # Limita anche i pool già caricati (se numpy era stato importato prima)
+    limit_native_pools()
+
+    return _policy
+
+def reconfigure():
+    """
+    Ricalcola il budget ignorando la configurazione già applicata
+    (es. in un processo figlio creato con fork, che eredita quella del padre)
+    """
+    global _policy
+
+    _policy = None
+    return configure()
+
+def thread_budget():
+    """
+    Budget di thread del processo
+    """
+    return configure()['threads_per_worker']
+
+def limit_native_pools():
+    """
+    Applica il budget ai pool BLAS/OpenMP già caricati nel processo
+    """
+    from threadpoolctl import threadpool_limits
+    threadpool_limits(limits=thread_budget())
+
+def apply_to_estimator(estimator, n_jobs=None):
+    """
+    Allinea il parametro n_jobs di un estimatore al budget del processo
+
+    Args:
+        estimator: Modello scikit-learn o xgboost
+        n_jobs: Valore da impostare (default: budget del processo)
+
+    Returns:
+        Lo stesso estimatore
+    """
+    if 'n_jobs' in estimator.get_params():
+        estimator.set_params(n_jobs=n_jobs or thread_budget())
+    return estimator
+
+def batch_estimator(estimator, n_rows):
+    """
+    Estimatore da usare per una predizione su n_rows righe
+
+    Per le predizioni grandi restituisce una copia superficiale con n_jobs pari
+    al budget del processo (l'estimatore condiviso, usato dalle richieste
+    singole, non viene modificato); altrimenti l'estimatore stesso.
+    """
+    budget = thread_budget()
+    if n_rows < PARALLEL_MIN_ROWS or budget == 1 or 'n_jobs' not in estimator.get_params():
+        return estimator
+    return copy.copy(estimator).set_params(n_jobs=budget)
+
+def report():
+    """
+    Configurazione effettiva, inclusi i pool nativi rilevati da threadpoolctl
+    """
+    from threadpoolctl import threadpool_info
+
+    return {
+        **configure(),
+        'native_pools': [
+            {
+                'user_api': pool.get('user_api'),
+                'internal_api': pool.get('internal_api'),
+                'num_threads': pool.get('num_threads')
+            }
+            for pool in threadpool_info()
+        ]
+    }
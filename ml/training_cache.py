@@ -0,0 +1,225 @@
+"""
+Cache dei dati di addestramento preprocessati
+Per ogni modello conserva su disco la matrice standardizzata (float32, letta
+in memory-map), gli indici della divisione train/test e lo scaler, con
+un'impronta del contenuto dei dati sorgente. Se i nuovi dati estendono quelli
+in cache vengono standardizzate solo le righe aggiunte con lo scaler
+esistente, così il modello precedente resta valido e può essere ripreso
+(warm start) invece di essere riaddestrato da zero
+"""
+
+import os
+import math
+import hashlib
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import StandardScaler
+import joblib
+
+CACHE_DIR = os.path.join(os.path.dirname(__file__), 'models/training_cache')
+
+# Crescita dei dati (rispetto all'ultima ricostruzione) oltre la quale
+# scaler, divisione e modello vengono ricalcolati da zero
+REFIT_GROWTH = 0.5
+
+def _row_hashes(data):
+    """
+    Hash di ogni riga del DataFrame sorgente (uint64)
+    """
+    return pd.util.hash_pandas_object(data, index=False).values
+
+def _fingerprint(columns, row_hashes):
+    digest = hashlib.sha1()
+    digest.update('\x1f'.join(columns).encode('utf-8'))
+    digest.update(np.ascontiguousarray(row_hashes).tobytes())
+    return digest.hexdigest()[:16]
+
+def _save_array(path, array):
+    """
+    Salva un array .npy con sostituzione atomica
+    """
+    tmp_path = path + '.tmp.npy'
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+class _CacheFiles:
+    """
+    Percorsi dei file in cache per un modello
+    """
+
+    def __init__(self, name):
+        self.dir = os.path.join(CACHE_DIR, name)
+        self.meta = os.path.join(self.dir, 'meta.joblib')
+        self.X = os.path.join(self.dir, 'X_scaled.npy')
+        self.hashes = os.path.join(self.dir, 'row_hashes.npy')
+        self.train_idx = os.path.join(self.dir, 'train_idx.npy')
+        self.test_idx = os.path.join(self.dir, 'test_idx.npy')
+
+    def load_meta(self):
+        if not os.path.exists(self.meta):
+            return None
+        meta = joblib.load(self.meta)
+        # Scarta una cache scritta solo in parte
+        if not os.path.exists(self.X) or np.load(self.X, mmap_mode='r').shape[0] != meta['n_rows']:
+            return None
+        return meta
+
+def _training_data(files, meta, status, n_new):
+    return {
+        'X': np.load(files.X, mmap_mode='r'),
+        'train_idx': np.load(files.train_idx),
+        'test_idx': np.load(files.test_idx),
+        'scaler': meta['scaler'],
+        'scaler_id': meta['scaler_id'],
+        'fingerprint': meta['fingerprint'],
+        'n_rows': meta['n_rows'],
+        'n_new': n_new,
+        'status': status
+    }
+
+def _rebuild(files, X, row_hashes, fingerprint, test_size, random_state):
+    """
+    Ricostruisce la cache da zero: divisione, stima dello scaler e standardizzazione
+    """
+    indices = np.arange(len(X))
+    if test_size:
+        train_idx, test_idx = train_test_split(indices, test_size=test_size, random_state=random_state)
+    else:
+        train_idx, test_idx = indices, np.empty(0, dtype=indices.dtype)
+
+    scaler = StandardScaler()
+    scaler.fit(X.iloc[train_idx])
+
+    os.makedirs(files.dir, exist_ok=True)
+    _save_array(files.X, scaler.transform(X).astype(np.float32))
+    _save_array(files.hashes, row_hashes)
+    _save_array(files.train_idx, train_idx)
+    _save_array(files.test_idx, test_idx)
+
+    meta = {
+        'fingerprint': fingerprint,
+        'columns': list(X.columns),
+        'n_rows': len(X),
+        'base_rows': len(X),
+        'scaler': scaler,
+        'scaler_id': fingerprint,
+        'test_size': test_size,
+        'random_state': random_state
+    }
+    joblib.dump(meta, files.meta)
+    return meta
+
+def _append(files, meta, X, row_hashes, fingerprint):
+    """
+    Standardizza solo le righe aggiunte e le accoda alla cache esistente
+    """
+    n_old = meta['n_rows']
+    new_scaled = meta['scaler'].transform(X.iloc[n_old:]).astype(np.float32)
+
+    # Le nuove righe finiscono nel test set con la stessa proporzione della divisione iniziale
+    new_indices = np.arange(n_old, len(X))
+    if meta['test_size']:
+        in_test = np.random.RandomState(meta['random_state'] + n_old).rand(len(new_indices)) < meta['test_size']
+    else:
+        in_test = np.zeros(len(new_indices), dtype=bool)
+
+    old_X = np.load(files.X, mmap_mode='r')
+    tmp_path = files.X + '.tmp.npy'
+    X_scaled = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=(len(X), old_X.shape[1]))
+    X_scaled[:n_old] = old_X
+    X_scaled[n_old:] = new_scaled
+    X_scaled.flush()
+    del X_scaled, old_X
+    os.replace(tmp_path, files.X)
+
+    _save_array(files.hashes, row_hashes)
+    _save_array(files.train_idx, np.concatenate([np.load(files.train_idx), new_indices[~in_test]]))
+    _save_array(files.test_idx, np.concatenate([np.load(files.test_idx), new_indices[in_test]]))
+
+    meta = {**meta, 'fingerprint': fingerprint, 'n_rows': len(X)}
+    joblib.dump(meta, files.meta)
+    return meta
+
+def load_training_data(name, X, test_size=0.2, random_state=42, source=None):
+    """
+    Restituisce i dati standardizzati di un modello, aggiornando la cache se necessario
+
+    Args:
+        name: Nome del modello (sottocartella della cache)
+        X: DataFrame delle feature
+        test_size: Frazione di test della divisione (None = nessuna divisione)
+        random_state: Seme della divisione iniziale
+        source: DataFrame sorgente su cui calcolare l'impronta (default: X),
+            da passare quando contiene anche il target
+
+    Returns:
+        Dizionario con 'X' (memmap float32), 'train_idx', 'test_idx', 'scaler',
+        'scaler_id', 'n_rows', 'n_new' e 'status' ('hit', 'append' o 'rebuild')
+    """
+    files = _CacheFiles(name)
+    source = X if source is None else source
+    row_hashes = _row_hashes(source)
+    fingerprint = _fingerprint(list(source.columns), row_hashes)
+    meta = files.load_meta()
+
+    if meta is not None and meta['fingerprint'] == fingerprint:
+        return _training_data(files, meta, 'hit', 0)
+
+    n_old = meta['n_rows'] if meta is not None else 0
+    can_append = (
+        meta is not None
+        and meta['columns'] == list(X.columns)
+        and meta['test_size'] == test_size
+        and n_old < len(X) <= meta['base_rows'] * (1 + REFIT_GROWTH)
+        and np.array_equal(np.load(files.hashes, mmap_mode='r'), row_hashes[:n_old])
+    )
+
+    if can_append:
+        meta = _append(files, meta, X, row_hashes, fingerprint)
+        print(f"Cache di addestramento {name}: {len(X) - n_old} nuove righe standardizzate")
+        return _training_data(files, meta, 'append', len(X) - n_old)
+
+    meta = _rebuild(files, X, row_hashes, fingerprint, test_size, random_state)
+    print(f"Cache di addestramento {name}: ricostruita ({len(X)} righe)")
+    return _training_data(files, meta, 'rebuild', len(X))
+
+def previous_artifact(model_path, training):
+    """
+    Carica l'artefatto precedente se può essere ripreso con i dati correnti
+
+    L'artefatto è riutilizzabile solo se è stato addestrato con lo stesso
+    scaler della cache e su un prefisso dei dati attuali.
+    """
+    if not os.path.exists(model_path):
+        return None
+    model_data = joblib.load(model_path)
+    info = model_data.get('training_cache')
+    if info is None or info['scaler_id'] != training['scaler_id'] or info['n_rows'] > training['n_rows']:
+        return None
+    return model_data
+
+def extra_estimators(base_estimators, n_new, n_previous):
+    """
+    Numero di alberi (o round di boosting) da aggiungere in proporzione ai nuovi dati
+    """
+    if n_new <= 0:
+        return 0
+    return max(1, math.ceil(base_estimators * n_new / n_previous))
+
+def artifact_info(training, mode, base_estimators=None):
+    """
+    Metadati della cache da salvare nell'artefatto del modello
+
+    Args:
+        training: Dati restituiti da load_training_data
+        mode: 'cold' (addestramento da zero), 'warm' (ripreso) o 'unchanged'
+        base_estimators: Alberi dell'ultimo addestramento da zero (modelli ad albero)
+    """
+    return {
+        'fingerprint': training['fingerprint'],
+        'scaler_id': training['scaler_id'],
+        'n_rows': training['n_rows'],
+        'mode': mode,
+        'base_estimators': base_estimators
+    }
@@ -0,0 +1,127 @@
+"""
+Ricerca degli iperparametri per i modelli di machine learning
+Esegue una cross-validation con successive halving in un pool di processi
+"""
+
+import os
+import json
+import math
+import time
+import shutil
+import tempfile
+from collections import defaultdict
+import numpy as np
+from joblib import Memory
+from sklearn.base import is_classifier
+from sklearn.pipeline import Pipeline
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+from sklearn.model_selection import HalvingGridSearchCV, StratifiedKFold
+
+REPORTS_DIR = os.path.join(os.path.dirname(__file__), 'models')
+
+# Numero di fold della cross-validation
+CV_FOLDS = 5
+
+# Fattore di eliminazione: a ogni round sopravvive 1/FACTOR dei candidati
+HALVING_FACTOR = 3
+
+# Campioni minimi per fold di validazione nel primo round di halving (e, per i
+# classificatori, campioni minimi della classe meno frequente): con meno dati
+# metriche come roc_auc non sono definite e tutti i candidati valgono NaN
+MIN_SAMPLES_PER_FOLD = 20
+MIN_CLASS_SAMPLES_PER_FOLD = 10
+
+def _min_resources(y, n_samples, classifier):
+    """
+    Campioni del primo round di halving, abbastanza perché ogni fold di
+    validazione contenga dati (e tutte le classi) a sufficienza
+
+    Il sottocampionamento di HalvingGridSearchCV non è stratificato, quindi
+    la soglia per le classi è stimata dalla frequenza della classe più rara.
+    """
+    per_fold = MIN_SAMPLES_PER_FOLD
+    if classifier:
+        _, counts = np.unique(y, return_counts=True)
+        per_fold = max(per_fold, math.ceil(MIN_CLASS_SAMPLES_PER_FOLD * n_samples / counts.min()))
+    return min(n_samples, CV_FOLDS * per_fold)
+
+def tune_hyperparameters(name, steps, param_grid, X, y=None, scoring=None, random_state=42):
+    """
+    Cerca i migliori iperparametri per una pipeline con successive halving
+
+    Le trasformazioni della pipeline (standardizzazione, PCA) vengono memorizzate
+    in una cache su disco condivisa tra i processi, così i candidati che
+    differiscono solo per l'ultimo step riusano i fold già preprocessati.
+
+    Args:
+        name: Nome del modello (usato per il report)
+        steps: Lista di step (nome, estimatore) della pipeline
+        param_grid: Griglia di parametri con chiavi 'step__parametro'
+        X: Caratteristiche di addestramento
+        y: Target di addestramento (None per modelli non supervisionati)
+        scoring: Metrica di valutazione (stringa sklearn o callable)
+        random_state: Seed per la riproducibilità
+
+    Returns:
+        Migliori parametri raggruppati per step e il report della ricerca
+    """
+    cache_dir = tempfile.mkdtemp(prefix=f'{name}_tuning_')
+    start = time.time()
+
+    try:
+        pipeline = Pipeline(steps, memory=Memory(cache_dir, verbose=0))
+        classifier = is_classifier(pipeline)
+        # Per i classificatori fold stratificati, così ogni fold contiene tutte le classi
+        cv = StratifiedKFold(CV_FOLDS, shuffle=True, random_state=random_state) if classifier else CV_FOLDS
+        min_resources = _min_resources(y, len(X), classifier)
+        search = HalvingGridSearchCV(
+            pipeline,
+            param_grid,
+            factor=HALVING_FACTOR,
+            cv=cv,
+            min_resources=min_resources,
+            scoring=scoring,
+            n_jobs=-1,
+            random_state=random_state,
+            refit=False
+        )
+        search.fit(X, y)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    best_params = defaultdict(dict)
+    for key, value in search.best_params_.items():
+        step, param = key.split('__', 1)
+        best_params[step][param] = value.item() if isinstance(value, np.generic) else value
+
+    report = {
+        'model': name,
+        'best_score': float(search.best_score_),
+        'best_params': dict(best_params),
+        'cv_folds': CV_FOLDS,
+        'min_resources': min_resources,
+        'n_candidates': [int(n) for n in search.n_candidates_],
+        'n_resources': [int(n) for n in search.n_resources_],
+        'elapsed_seconds': round(time.time() - start, 2)
+    }
+
+    print(f"Tuning {name}: miglior score CV {report['best_score']:.4f} con {report['best_params']}")
+
+    return dict(best_params), report
+
+def save_report(name, report):
+    """
+    Salva il report della ricerca in formato JSON accanto agli artefatti
+
+    Args:
+        name: Nome del modello
+        report: Dizionario con il report della ricerca
+
+    Returns:
+        Percorso del file salvato
+    """
+    os.makedirs(REPORTS_DIR, exist_ok=True)
+    path = os.path.join(REPORTS_DIR, f'{name}_tuning_report.json')
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    return path
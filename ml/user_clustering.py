@@ -9,13 +9,30 @@ import pandas as pd
 from sklearn.cluster import KMeans
 from sklearn.preprocessing import StandardScaler
 from sklearn.decomposition import PCA
+from sklearn.metrics import silhouette_score
 import joblib
 
+import tuning
+import training_cache
+import thread_policy
+import drift
+
 MODEL_PATH = os.path.join(os.path.dirname(__file__), 'models/user_clustering_model.joblib')
 
 # Numero di cluster
 N_CLUSTERS = 5
 
+# Iperparametri predefiniti di PCA e k-means
+PCA_PARAMS = {'n_components': 5}
+KMEANS_PARAMS = {'random_state': 42, 'n_init': 10}
+
+# Griglia esplorata in modalità tuning (il numero di cluster resta N_CLUSTERS)
+TUNING_GRID = {
+    'pca__n_components': [3, 5, 7, 9],
+    'kmeans__init': ['k-means++', 'random'],
+    'kmeans__n_init': [5, 10]
+}
+
 # Nomi descrittivi dei cluster
 CLUSTER_DESCRIPTIONS = {
     0: "Proprietari attivi",
@@ -34,12 +51,26 @@ CLUSTER_FEATURES = {
     4: ["Login poco frequenti", "Sessioni brevi", "Nessuna transazione recente"]
 }
 
-def train_model(data_path=None):
+def _silhouette_scorer(estimator, X, y=None):
+    """
+    Valuta una pipeline di clustering con il coefficiente di silhouette
+
+    Il punteggio è calcolato nello spazio standardizzato, così da restare
+    confrontabile tra candidati con un numero diverso di componenti PCA.
+    """
+    labels = estimator.predict(X)
+    if len(np.unique(labels)) < 2:
+        return -1.0
+    return silhouette_score(estimator.named_steps['scaler'].transform(X), labels)
+
+def train_model(data_path=None, tune=False, warm_start=True):
     """
     Addestra il modello di clustering degli utenti
     
     Args:
         data_path: Percorso del file CSV con i dati degli utenti (opzionale)
+        tune: Se True, cerca gli iperparametri di PCA e k-means con cross-validation
+        warm_start: Se True, riprende PCA e centroidi precedenti quando i dati sono solo cresciuti
     
     Returns:
         Il modello addestrato
@@ -108,22 +139,63 @@ def train_model(data_path=None):
         # Carica dati reali
         data = pd.read_csv(data_path)
     
-    # Standardizzazione dei dati
-    scaler = StandardScaler()
-    data_scaled = scaler.fit_transform(data)
-    
-    # Riduzione dimensionalità (opzionale)
-    pca = PCA(n_components=5)
-    data_pca = pca.fit_transform(data_scaled)
-    
-    # Clustering
-    kmeans = KMeans(n_clusters=N_CLUSTERS, random_state=42, n_init=10)
-    clusters = kmeans.fit_predict(data_pca)
+    # Ricerca degli iperparametri (opzionale)
+    pca_params = dict(PCA_PARAMS)
+    kmeans_params = dict(KMEANS_PARAMS)
+    tuning_report = None
+    if tune:
+        best_params, tuning_report = tuning.tune_hyperparameters(
+            'user_clustering',
+            [
+                ('scaler', StandardScaler()),
+                ('pca', PCA(**PCA_PARAMS)),
+                ('kmeans', KMeans(n_clusters=N_CLUSTERS, **KMEANS_PARAMS))
+            ],
+            TUNING_GRID,
+            data,
+            scoring=_silhouette_scorer
+        )
+        pca_params.update(best_params.get('pca', {}))
+        kmeans_params.update(best_params.get('kmeans', {}))
+    
+    # Dati standardizzati dalla cache (solo le righe nuove vengono elaborate)
+    training = training_cache.load_training_data('user_clustering', data, test_size=None)
+    scaler = training['scaler']
+    # PCA e k-means lavorano in float64, come le predizioni
+    data_scaled = np.asarray(training['X'], dtype=np.float64)
+    
+    # Ripresa del modello precedente: stessa PCA e k-means inizializzato dai centroidi
+    previous = training_cache.previous_artifact(MODEL_PATH, training) if warm_start and not tune else None
+    if previous is not None:
+        pca = previous['pca']
+        data_pca = pca.transform(data_scaled)
+        if training['n_rows'] > previous['training_cache']['n_rows']:
+            print("User Clustering Model: warm start dai centroidi precedenti")
+            kmeans = KMeans(**{
+                **previous['kmeans'].get_params(),
+                'init': previous['kmeans'].cluster_centers_,
+                'n_init': 1
+            })
+            clusters = kmeans.fit_predict(data_pca)
+            mode = 'warm'
+        else:
+            kmeans = previous['kmeans']
+            clusters = kmeans.predict(data_pca)
+            mode = 'unchanged'
+    else:
+        # Riduzione dimensionalità (opzionale)
+        pca = PCA(**pca_params)
+        data_pca = pca.fit_transform(data_scaled)
+        
+        # Clustering
+        kmeans = KMeans(n_clusters=N_CLUSTERS, **kmeans_params)
+        clusters = kmeans.fit_predict(data_pca)
+        mode = 'cold'
     
     # Visualizzazione della distribuzione dei cluster
     cluster_counts = np.bincount(clusters, minlength=N_CLUSTERS)
     for i in range(N_CLUSTERS):
-        print(f"Cluster {i} ({CLUSTER_DESCRIPTIONS[i]}): {cluster_counts[i]} utenti ({cluster_counts[i]/n_samples*100:.1f}%)")
+        print(f"Cluster {i} ({CLUSTER_DESCRIPTIONS[i]}): {cluster_counts[i]} utenti ({cluster_counts[i]/len(data)*100:.1f}%)")
     
     # Calcolo dei centroidi originali per interpretazione
     cluster_centers_scaled = kmeans.cluster_centers_
@@ -141,9 +213,16 @@ def train_model(data_path=None):
         'features': list(data.columns),
         'cluster_descriptions': CLUSTER_DESCRIPTIONS,
         'cluster_features': CLUSTER_FEATURES,
-        'centers': centers_df
+        'centers': centers_df,
+        'drift_reference': drift.build_reference(data),
+        'training_cache': training_cache.artifact_info(training, mode)
     }
     
+    if tuning_report is not None:
+        tuning_report['silhouette'] = float(silhouette_score(data_scaled, clusters))
+        tuning.save_report('user_clustering', tuning_report)
+        model_data['tuning'] = tuning_report
+    
     os.makedirs(os.path.dirname(MODEL_PATH), exist_ok=True)
     joblib.dump(model_data, MODEL_PATH)
     
@@ -158,10 +237,108 @@ def load_model():
     """
     # Se il modello non esiste, addestralo
     if not os.path.exists(MODEL_PATH):
-        return train_model()
+        model_data = train_model()
+    else:
+        # Carica il modello esistente
+        model_data = joblib.load(MODEL_PATH)
+    
+    # Allinea i thread del modello al budget del processo
+    thread_policy.apply_to_estimator(model_data['kmeans'])
     
-    # Carica il modello esistente
-    return joblib.load(MODEL_PATH)
+    return model_data
+
+def embed_users(users_data, model_data=None):
+    """
+    Proietta una lista di utenti nello spazio PCA del clustering
+
+    Args:
+        users_data: Lista di dizionari (o DataFrame) con i dati degli utenti
+        model_data: Modello già caricato (opzionale, altrimenti viene caricato)
+
+    Returns:
+        Vettori PCA (n, n_components) e cluster assegnati (n,)
+    """
+    # Carica il modello
+    if model_data is None:
+        model_data = load_model()
+    kmeans = model_data['kmeans']
+    scaler = model_data['scaler']
+    pca = model_data['pca']
+    features = model_data['features']
+    
+    # Seleziona le feature nel giusto ordine (mancanti a 0)
+    users_df = pd.DataFrame(users_data).reindex(columns=features).fillna(0)
+    
+    # Standardizza e riduce la dimensionalità in un'unica passata
+    users_pca = pca.transform(scaler.transform(users_df))
+    
+    return users_pca, kmeans.predict(users_pca)
+
+def _belongingness(users_pca, cluster_centers):
+    """
+    "Forza" di appartenenza di ogni utente a ogni cluster, dalla distanza dai centroidi
+    
+    Returns:
+        Array (utenti, cluster) con valori tra 0 e 1
+    """
+    distances = np.sqrt(((users_pca[:, np.newaxis, :] - cluster_centers) ** 2).sum(axis=2))
+    normalized_distances = distances / distances.sum(axis=1, keepdims=True)
+    return 1 - normalized_distances / normalized_distances.max(axis=1, keepdims=True)
+
+def _distinctive_features(user_values, centroid, features):
+    """
+    Caratteristiche dell'utente significativamente diverse dal centroide (max 3)
+    """
+    user_features = []
+    
+    # Confronta valori utente con centroidi
+    for feature in features:
+        user_value = user_values[feature]
+        center_value = centroid[feature]
+        
+        # Se il valore dell'utente è significativamente diverso dal centroide
+        if abs(user_value - center_value) > 0.5 * center_value:
+            # Determina se è più alto o più basso
+            direction = "alto" if user_value > center_value else "basso"
+            user_features.append(f"{feature.replace('_', ' ')}: {direction}")
+    
+    # Limita a max 3 caratteristiche
+    return user_features[:3]
+
+def _cluster_result(cluster_id, belongingness, user_features, model_data):
+    """
+    Compone la risposta per un utente assegnato a un cluster
+    """
+    return {
+        'cluster_id': int(cluster_id),
+        'cluster_name': model_data['cluster_descriptions'][cluster_id],
+        'confidence': float(belongingness[cluster_id]),
+        'cluster_features': model_data['cluster_features'][cluster_id],
+        'user_distinctive_features': user_features,
+        'cluster_distribution': {
+            str(i): float(belongingness[i]) for i in range(N_CLUSTERS)
+        }
+    }
+
+def predict_user_clusters(users_df, model_data=None):
+    """
+    Predice il cluster e la confidenza di appartenenza per più utenti
+    
+    Args:
+        users_df: DataFrame con una riga per utente
+        model_data: Modello già caricato (opzionale, altrimenti viene caricato)
+    
+    Returns:
+        Array dei cluster assegnati e array delle confidenze
+    """
+    if model_data is None:
+        model_data = load_model()
+    
+    users_pca, cluster_ids = embed_users(users_df, model_data)
+    
+    belongingness = _belongingness(users_pca, model_data['kmeans'].cluster_centers_)
+    
+    return cluster_ids, belongingness[np.arange(len(cluster_ids)), cluster_ids]
 
 def predict_user_cluster(user_data):
     """
@@ -179,8 +356,6 @@ def predict_user_cluster(user_data):
     scaler = model_data['scaler']
     pca = model_data['pca']
     features = model_data['features']
-    cluster_descriptions = model_data['cluster_descriptions']
-    cluster_features = model_data['cluster_features']
     centers = model_data['centers']
     
     # Crea DataFrame dall'utente
@@ -194,6 +369,9 @@ def predict_user_cluster(user_data):
     # Seleziona le feature nel giusto ordine
     user_df = user_df[features]
     
+    # Aggiorna gli istogrammi di deriva degli input
+    drift.observe('user_clustering', model_data, user_df.values)
+    
     # Standardizza
     user_scaled = scaler.transform(user_df)
     
@@ -204,38 +382,43 @@ def predict_user_cluster(user_data):
     cluster_id = kmeans.predict(user_pca)[0]
     
     # Calcolo distanza dai centroidi per determinare la "forza" dell'appartenenza
-    distances = np.sqrt(((user_pca - kmeans.cluster_centers_) ** 2).sum(axis=1))
-    normalized_distances = distances / distances.sum()
-    belongingness = 1 - (normalized_distances / normalized_distances.max())
+    belongingness = _belongingness(user_pca, kmeans.cluster_centers_)[0]
     
     # Determina le caratteristiche distintive dell'utente rispetto al centroide
-    user_features = []
-    centroid = centers.iloc[cluster_id]
+    user_features = _distinctive_features(user_df.iloc[0], centers.iloc[cluster_id], features)
     
-    # Confronta valori utente con centroidi
-    for feature in features:
-        user_value = user_df[feature].values[0]
-        center_value = centroid[feature]
-        
-        # Se il valore dell'utente è significativamente diverso dal centroide
-        if abs(user_value - center_value) > 0.5 * center_value:
-            # Determina se è più alto o più basso
-            direction = "alto" if user_value > center_value else "basso"
-            user_features.append(f"{feature.replace('_', ' ')}: {direction}")
+    return _cluster_result(cluster_id, belongingness, user_features, model_data)
+
+def predict_user_cluster_batch(users_data):
+    """
+    Predice il cluster di appartenenza per più utenti con una sola predizione
     
-    # Limita a max 3 caratteristiche
-    user_features = user_features[:3]
+    Args:
+        users_data: Lista di dizionari con i dati degli utenti
     
-    return {
-        'cluster_id': int(cluster_id),
-        'cluster_name': cluster_descriptions[cluster_id],
-        'confidence': float(belongingness[cluster_id]),
-        'cluster_features': cluster_features[cluster_id],
-        'user_distinctive_features': user_features,
-        'cluster_distribution': {
-            str(i): float(belongingness[i]) for i in range(N_CLUSTERS)
-        }
-    }
+    Returns:
+        Lista di risultati nello stesso formato di predict_user_cluster
+    """
+    model_data = load_model()
+    features = model_data['features']
+    centers = model_data['centers']
+    users_df = pd.DataFrame(users_data).reindex(columns=features).fillna(0)
+    
+    # Aggiorna gli istogrammi di deriva degli input
+    drift.observe('user_clustering', model_data, users_df.values)
+    
+    users_pca, cluster_ids = embed_users(users_df, model_data)
+    belongingness = _belongingness(users_pca, model_data['kmeans'].cluster_centers_)
+    
+    return [
+        _cluster_result(
+            cluster_id,
+            belongingness[i],
+            _distinctive_features(users_df.iloc[i], centers.iloc[cluster_id], features),
+            model_data
+        )
+        for i, cluster_id in enumerate(cluster_ids)
+    ]
 
 if __name__ == "__main__":
     # Test di addestramento e predizione
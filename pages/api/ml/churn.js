@@ -5,6 +5,7 @@
 import { db } from '../../../server/db';
 import { users } from '../../../shared/schema';
 import { eq } from 'drizzle-orm';
+import { mlPost, MLServiceError, sendMLError } from '../utils/mlClient';
 
 /**
  * Endpoint per prevedere il rischio di abbandono degli utenti
@@ -56,28 +57,15 @@ export default async function handler(req, res) {
       };
     }
     
-    // Chiamata al servizio ML
-    const mlResponse = await fetch('http://localhost:5001/churn', {
-      method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-      },
-      body: JSON.stringify(userData),
-    });
-    
-    if (!mlResponse.ok) {
-      const errorText = await mlResponse.text();
-      console.error('Errore dal servizio ML:', errorText);
-      return res.status(mlResponse.status).json({ 
-        error: 'Errore nel servizio ML',
-        details: errorText
-      });
-    }
-    
-    const result = await mlResponse.json();
+    // Chiamata al servizio ML (pool keep-alive, cache e deduplica delle richieste)
+    const result = await mlPost('/churn', userData);
     
     return res.status(200).json(result);
   } catch (error) {
+    if (error instanceof MLServiceError) {
+      return sendMLError(res, error);
+    }
+    
     console.error('Errore nella previsione churn:', error);
     return res.status(500).json({ error: 'Errore del server', details: error.message });
   }
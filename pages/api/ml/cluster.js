@@ -5,6 +5,7 @@
 import { db } from '../../../server/db';
 import { users } from '../../../shared/schema';
 import { eq } from 'drizzle-orm';
+import { mlPost, MLServiceError, sendMLError } from '../utils/mlClient';
 
 /**
  * Endpoint per il clustering degli utenti
@@ -47,6 +48,8 @@ export default async function handler(req, res) {
       
       // Converti i dati dell'utente nel formato richiesto dal modello ML
       userData = {
+        // Identifica l'utente per le statistiche dei segmenti del servizio ML
+        user_id: userId,
         properties_viewed_monthly: behaviorData.properties_viewed_monthly,
         avg_view_duration_sec: behaviorData.avg_view_duration_sec,
         search_count_monthly: behaviorData.search_count_monthly,
@@ -64,28 +67,15 @@ export default async function handler(req, res) {
       };
     }
     
-    // Chiamata al servizio ML
-    const mlResponse = await fetch('http://localhost:5001/cluster', {
-      method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-      },
-      body: JSON.stringify(userData),
-    });
-    
-    if (!mlResponse.ok) {
-      const errorText = await mlResponse.text();
-      console.error('Errore dal servizio ML:', errorText);
-      return res.status(mlResponse.status).json({ 
-        error: 'Errore nel servizio ML',
-        details: errorText
-      });
-    }
-    
-    const result = await mlResponse.json();
+    // Chiamata al servizio ML (pool keep-alive, cache e deduplica delle richieste)
+    const result = await mlPost('/cluster', userData);
     
     return res.status(200).json(result);
   } catch (error) {
+    if (error instanceof MLServiceError) {
+      return sendMLError(res, error);
+    }
+    
     console.error('Errore nel clustering utenti:', error);
     return res.status(500).json({ error: 'Errore del server', details: error.message });
   }
@@ -0,0 +1,30 @@
+/**
+ * API wrapper per il riepilogo dei segmenti utente
+ */
+
+import { mlGet, MLServiceError, sendMLError } from '../../utils/mlClient';
+
+/**
+ * Endpoint per dimensioni, medie delle feature e transizioni dei cluster
+ * 
+ * @param {import('next').NextApiRequest} req
+ * @param {import('next').NextApiResponse} res
+ */
+export default async function handler(req, res) {
+  if (req.method !== 'GET') {
+    return res.status(405).json({ error: 'Metodo non consentito' });
+  }
+  
+  try {
+    const result = await mlGet('/clusters/summary');
+    
+    return res.status(200).json(result);
+  } catch (error) {
+    if (error instanceof MLServiceError) {
+      return sendMLError(res, error);
+    }
+    
+    console.error('Errore nel riepilogo dei cluster:', error);
+    return res.status(500).json({ error: 'Errore del server', details: error.message });
+  }
+}
@@ -5,6 +5,7 @@
 import { db } from '../../../server/db';
 import { properties } from '../../../shared/schema';
 import { eq } from 'drizzle-orm';
+import { mlPost, MLServiceError, sendMLError } from '../utils/mlClient';
 
 /**
  * Endpoint per ottenere suggerimenti di prezzo dinamici
@@ -53,28 +54,15 @@ export default async function handler(req, res) {
       };
     }
     
-    // Chiamata al servizio ML
-    const mlResponse = await fetch('http://localhost:5001/dynamic-pricing', {
-      method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-      },
-      body: JSON.stringify(propertyData),
-    });
-    
-    if (!mlResponse.ok) {
-      const errorText = await mlResponse.text();
-      console.error('Errore dal servizio ML:', errorText);
-      return res.status(mlResponse.status).json({ 
-        error: 'Errore nel servizio ML',
-        details: errorText
-      });
-    }
-    
-    const result = await mlResponse.json();
+    // Chiamata al servizio ML (pool keep-alive, cache e deduplica delle richieste)
+    const result = await mlPost('/dynamic-pricing', propertyData);
     
     return res.status(200).json(result);
   } catch (error) {
+    if (error instanceof MLServiceError) {
+      return sendMLError(res, error);
+    }
+    
     console.error('Errore nel dynamic pricing:', error);
     return res.status(500).json({ error: 'Errore del server', details: error.message });
   }
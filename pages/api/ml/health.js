@@ -0,0 +1,30 @@
+/**
+ * API wrapper per lo stato del microservizio ML
+ */
+
+import { mlGet, MLServiceError, sendMLError } from '../utils/mlClient';
+
+/**
+ * Endpoint per controllare lo stato del servizio ML
+ * 
+ * @param {import('next').NextApiRequest} req
+ * @param {import('next').NextApiResponse} res
+ */
+export default async function handler(req, res) {
+  if (req.method !== 'GET') {
+    return res.status(405).json({ error: 'Metodo non consentito' });
+  }
+  
+  try {
+    const result = await mlGet('/health', { timeoutMs: 2000 });
+    
+    return res.status(200).json(result);
+  } catch (error) {
+    if (error instanceof MLServiceError) {
+      return sendMLError(res, error);
+    }
+    
+    console.error('Servizio ML non raggiungibile:', error);
+    return res.status(503).json({ error: 'Servizio ML non raggiungibile', details: error.message });
+  }
+}
@@ -0,0 +1,278 @@
+import http from 'http';
+
+/**
+ * Client condiviso per il microservizio ML (Flask, ml/api.py)
+ *
+ * - connessioni keep-alive con pool limitato
+ * - budget di timeout per richiesta (inviato anche come scadenza al servizio)
+ * - single-flight: richieste identiche concorrenti condividono la stessa chiamata
+ * - cache LRU con TTL breve sui risultati
+ * - auto-batching opzionale delle richieste singole verso gli endpoint /batch
+ */
+
+const ML_SERVICE_URL = new URL(process.env.ML_SERVICE_URL || 'http://localhost:5001');
+
+// Tempo massimo concesso al servizio ML (inviato anche come scadenza)
+const ML_TIMEOUT_MS = Number(process.env.ML_TIMEOUT_MS || 5000);
+
+// Dimensione del pool di connessioni verso il servizio ML
+const ML_MAX_SOCKETS = Number(process.env.ML_MAX_SOCKETS || 16);
+
+// Cache dei risultati
+const CACHE_TTL_MS = Number(process.env.ML_CACHE_TTL_MS || 30000);
+const CACHE_MAX_ENTRIES = Number(process.env.ML_CACHE_MAX_ENTRIES || 500);
+
+// Auto-batching: finestra di raccolta e dimensione massima del batch
+const AUTO_BATCH = process.env.ML_AUTO_BATCH === 'true';
+const BATCH_WINDOW_MS = Number(process.env.ML_BATCH_WINDOW_MS || 5);
+const MAX_BATCH_SIZE = 64;
+
+// Stati di un batch fallito che non dipendono dal contenuto (servizio saturo o
+// scadenza): in questi casi le richieste non vengono ritentate singolarmente
+const BATCH_NO_RETRY_STATUSES = new Set([429, 503, 504]);
+
+const agent = new http.Agent({
+  keepAlive: true,
+  maxSockets: ML_MAX_SOCKETS,
+  maxFreeSockets: Math.ceil(ML_MAX_SOCKETS / 2),
+});
+
+/**
+ * Errore restituito dal servizio ML (stato HTTP non 2xx)
+ */
+export class MLServiceError extends Error {
+  constructor(status, details, retryAfter) {
+    super(`Errore dal servizio ML (${status})`);
+    this.status = status;
+    this.details = details;
+    this.retryAfter = retryAfter;
+  }
+}
+
+/**
+ * Cache LRU con scadenza basata su Map (l'ordine di inserimento è l'ordine d'uso)
+ */
+class LruCache {
+  constructor(maxEntries, ttlMs) {
+    this.maxEntries = maxEntries;
+    this.ttlMs = ttlMs;
+    this.entries = new Map();
+  }
+
+  get(key) {
+    const entry = this.entries.get(key);
+    if (!entry) return undefined;
+    if (entry.expiresAt <= Date.now()) {
+      this.entries.delete(key);
+      return undefined;
+    }
+    // Sposta in fondo (usato di recente)
+    this.entries.delete(key);
+    this.entries.set(key, entry);
+    return entry.value;
+  }
+
+  set(key, value) {
+    this.entries.delete(key);
+    this.entries.set(key, { value, expiresAt: Date.now() + this.ttlMs });
+    if (this.entries.size > this.maxEntries) {
+      this.entries.delete(this.entries.keys().next().value);
+    }
+  }
+}
+
+const cache = new LruCache(CACHE_MAX_ENTRIES, CACHE_TTL_MS);
+const inFlight = new Map();
+const batchQueues = new Map();
+
+/**
+ * Serializzazione JSON con chiavi ordinate, usata come chiave di cache
+ * @param {any} value Valore da serializzare
+ * @returns {string}
+ */
+function stableStringify(value) {
+  if (Array.isArray(value)) {
+    return `[${value.map(stableStringify).join(',')}]`;
+  }
+  if (value && typeof value === 'object') {
+    return `{${Object.keys(value).sort().map((key) => `${JSON.stringify(key)}:${stableStringify(value[key])}`).join(',')}}`;
+  }
+  return JSON.stringify(value);
+}
+
+/**
+ * Esegue una richiesta HTTP verso il servizio ML sul pool keep-alive
+ * @param {string} method Metodo HTTP
+ * @param {string} path Percorso dell'endpoint
+ * @param {Object} [payload] Corpo JSON
+ * @param {Object} [options] { timeoutMs, priority }
+ * @returns {Promise<Object>} Risposta JSON
+ */
+function rawRequest(method, path, payload, { timeoutMs = ML_TIMEOUT_MS, priority = 'interactive' } = {}) {
+  return new Promise((resolve, reject) => {
+    const body = payload === undefined ? null : JSON.stringify(payload);
+    const req = http.request({
+      protocol: ML_SERVICE_URL.protocol,
+      hostname: ML_SERVICE_URL.hostname,
+      port: ML_SERVICE_URL.port,
+      path,
+      method,
+      agent,
+      timeout: timeoutMs,
+      headers: {
+        'Content-Type': 'application/json',
+        'X-Request-Deadline': String(Date.now() + timeoutMs),
+        'X-Request-Priority': priority,
+        ...(body ? { 'Content-Length': Buffer.byteLength(body) } : {}),
+      },
+    }, (res) => {
+      let data = '';
+      res.setEncoding('utf8');
+      res.on('data', (chunk) => { data += chunk; });
+      res.on('end', () => {
+        if (res.statusCode < 200 || res.statusCode >= 300) {
+          reject(new MLServiceError(res.statusCode, data, res.headers['retry-after']));
+          return;
+        }
+        try {
+          resolve(JSON.parse(data));
+        } catch (error) {
+          reject(new MLServiceError(502, 'Risposta non valida dal servizio ML'));
+        }
+      });
+    });
+
+    req.on('timeout', () => {
+      req.destroy(new MLServiceError(504, 'Timeout del servizio ML'));
+    });
+    req.on('error', reject);
+
+    if (body) req.write(body);
+    req.end();
+  });
+}
+
+/**
+ * Invia il batch accumulato per una coda e distribuisce i risultati
+ *
+ * Se il batch viene rifiutato per il suo contenuto (es. un solo elemento non
+ * valido) ogni richiesta viene ritentata singolarmente, così l'errore
+ * raggiunge solo il chiamante che l'ha causato.
+ * @param {string} queueKey Chiave della coda (endpoint e opzioni)
+ */
+async function flushBatch(queueKey) {
+  const queue = batchQueues.get(queueKey);
+  batchQueues.delete(queueKey);
+  if (!queue) return;
+
+  clearTimeout(queue.timer);
+  const { path, options, waiters } = queue;
+
+  try {
+    const { results } = await rawRequest('POST', `${path}/batch`, { items: waiters.map((w) => w.payload) }, options);
+    waiters.forEach((waiter, i) => waiter.resolve(results[i]));
+  } catch (error) {
+    const retryIndividually = waiters.length > 1
+      && error instanceof MLServiceError
+      && !BATCH_NO_RETRY_STATUSES.has(error.status);
+    if (!retryIndividually) {
+      waiters.forEach((waiter) => waiter.reject(error));
+      return;
+    }
+    waiters.forEach((waiter) => {
+      rawRequest('POST', path, waiter.payload, options).then(waiter.resolve, waiter.reject);
+    });
+  }
+}
+
+/**
+ * Accoda una richiesta singola nel batch dell'endpoint
+ *
+ * Le richieste condividono un batch solo se hanno le stesse opzioni, perché
+ * timeout e priorità vengono inviati per l'intero batch.
+ * @param {string} path Percorso dell'endpoint singolo
+ * @param {Object} payload Dati della richiesta
+ * @param {Object} [options] { timeoutMs, priority }
+ * @returns {Promise<Object>} Risultato della singola richiesta
+ */
+function enqueueBatch(path, payload, { timeoutMs = ML_TIMEOUT_MS, priority = 'interactive' } = {}) {
+  const queueKey = `${path}|${priority}|${timeoutMs}`;
+  return new Promise((resolve, reject) => {
+    let queue = batchQueues.get(queueKey);
+    if (!queue) {
+      queue = {
+        path,
+        options: { timeoutMs, priority },
+        waiters: [],
+        timer: setTimeout(() => flushBatch(queueKey), BATCH_WINDOW_MS),
+      };
+      batchQueues.set(queueKey, queue);
+    }
+    queue.waiters.push({ payload, resolve, reject });
+    if (queue.waiters.length >= MAX_BATCH_SIZE) {
+      flushBatch(queueKey);
+    }
+  });
+}
+
+/**
+ * Chiamata POST al servizio ML con cache, single-flight e batching opzionale
+ * @param {string} path Percorso dell'endpoint (es. '/churn')
+ * @param {Object} payload Dati della richiesta
+ * @param {Object} [options] { batch, cache, timeoutMs, priority }
+ * @returns {Promise<Object>} Risposta JSON del servizio ML
+ */
+export async function mlPost(path, payload, { batch = AUTO_BATCH, cache: useCache = true, ...requestOptions } = {}) {
+  const key = `${path}:${stableStringify(payload)}`;
+
+  if (useCache) {
+    const cached = cache.get(key);
+    if (cached !== undefined) return cached;
+  }
+
+  // Richieste identiche concorrenti condividono la stessa chiamata
+  if (inFlight.has(key)) {
+    return inFlight.get(key);
+  }
+
+  const promise = (batch ? enqueueBatch(path, payload, requestOptions) : rawRequest('POST', path, payload, requestOptions))
+    .then((result) => {
+      if (useCache) cache.set(key, result);
+      return result;
+    })
+    .finally(() => {
+      inFlight.delete(key);
+    });
+
+  inFlight.set(key, promise);
+  return promise;
+}
+
+/**
+ * Chiamata GET al servizio ML (senza cache)
+ * @param {string} path Percorso dell'endpoint (es. '/health')
+ * @param {Object} [options] { timeoutMs, priority }
+ * @returns {Promise<Object>} Risposta JSON del servizio ML
+ */
+export function mlGet(path, options) {
+  return rawRequest('GET', path, undefined, options);
+}
+
+/**
+ * Invia al client la risposta d'errore per un fallimento del servizio ML
+ * @param {import('next').NextApiResponse} res
+ * @param {MLServiceError} error
+ */
+export function sendMLError(res, error) {
+  console.error('Errore dal servizio ML:', error.details);
+
+  // Propaga l'indicazione di retry quando il servizio ML è saturo
+  if (error.retryAfter) {
+    res.setHeader('Retry-After', error.retryAfter);
+  }
+
+  return res.status(error.status).json({
+    error: 'Errore nel servizio ML',
+    details: error.details,
+  });
+}